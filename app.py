@@ -26,6 +26,12 @@ def create_app():
     from models import db  # Import db from models.py
     db.init_app(app)
     
+    # Fail fast when a hot query lost its index
+    if app.config.get('QUERY_PLAN_CHECK'):
+        from utils.query_plans import check_query_plans
+        with app.app_context():
+            check_query_plans()
+
     # Register Blueprints
     register_blueprints(app)
     
@@ -53,6 +59,7 @@ def register_blueprints(app):
     from routes.transportreport import transport_bp  
     from routes.paymentsReport import payments_report_bp
     from routes.classes import classes_bp  # <-- Add this line
+    from routes.saves import saves_bp
 
     # Register each blueprint with a URL prefix
     app.register_blueprint(auth_bp, url_prefix='/auth')
@@ -67,6 +74,7 @@ def register_blueprints(app):
     app.register_blueprint(transport_bp, url_prefix='/transport')
     app.register_blueprint(payments_report_bp, url_prefix='/payments-report')
     app.register_blueprint(classes_bp, url_prefix='/classes')  # Add the url_prefix here
+    app.register_blueprint(saves_bp, url_prefix='/saves')
 
 def setup_logging(app):
     # Create logs directory if it doesn’t exist
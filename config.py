@@ -20,5 +20,38 @@ class Config:
     SESSION_PERMANENT = False
     PERMANENT_SESSION_LIFETIME = 86400  # 24 hours in seconds
     
+    # Seconds a cached per-school-year payment matrix is served before being rebuilt
+    PAYMENT_MATRIX_MAX_AGE = int(os.getenv('PAYMENT_MATRIX_MAX_AGE', 300))
+
+    # Report cache: 'module:Class' of a utils.cache.CacheBackend, entry TTL in seconds and LRU size
+    REPORT_CACHE_ENABLED = os.getenv('REPORT_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    REPORT_CACHE_BACKEND = os.getenv('REPORT_CACHE_BACKEND', 'utils.cache:MemoryCache')
+    REPORT_CACHE_TTL = int(os.getenv('REPORT_CACHE_TTL', 60))
+    REPORT_CACHE_MAX_ENTRIES = int(os.getenv('REPORT_CACHE_MAX_ENTRIES', 256))
+
+    # Live feed (/accounting/daily/stream): seconds between heartbeats, and whether every
+    # worker follows a MongoDB change stream (replica set) instead of its own writes only
+    LIVE_FEED_HEARTBEAT = int(os.getenv('LIVE_FEED_HEARTBEAT', 15))
+    LIVE_FEED_CHANGE_STREAM = os.getenv('LIVE_FEED_CHANGE_STREAM', 'false').lower() in ('1', 'true', 'yes')
+
+    # Seconds a stored Idempotency-Key response is replayed to retries of the same request
+    IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))
+    # Seconds a request holds its Idempotency-Key while it runs; a retry takes over the key of a dead worker after it
+    IDEMPOTENCY_LEASE = int(os.getenv('IDEMPOTENCY_LEASE', 60))
+
+    # Explain the hot payment and daily queries at startup and refuse to start when one scans a whole collection
+    QUERY_PLAN_CHECK = os.getenv('QUERY_PLAN_CHECK', 'false').lower() in ('1', 'true', 'yes')
+
+    # Source of the real amounts: 'embedded' (Student.payments.real_payments) or 'ledger' (the Payment
+    # collection; the embedded copy becomes a projection, see maintenance.py rebuild-real-payments)
+    REAL_PAYMENTS_SOURCE = os.getenv('REAL_PAYMENTS_SOURCE', 'embedded')
+
+    # Save audit records: written by a background thread every AUDIT_BATCH_SIZE records or AUDIT_FLUSH_MS
+    # milliseconds; at most AUDIT_QUEUE_SIZE records wait in memory
+    AUDIT_ENABLED = os.getenv('AUDIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 100))
+    AUDIT_FLUSH_MS = int(os.getenv('AUDIT_FLUSH_MS', 500))
+
     # CORS settings
     CORS_HEADERS = 'Content-Type'
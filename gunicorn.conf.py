@@ -0,0 +1,32 @@
+# gunicorn.conf.py
+#
+# Loaded by gunicorn from the working directory: gunicorn app:app
+# Every setting can be overridden from the environment.
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from config import Config  # Import Config after loading environment variables
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+
+# /accounting/daily/stream keeps one connection open per cashier screen. With
+# gevent each one is a greenlet waiting on its queue, so a worker holds many of
+# them; a sync worker would be pinned by a single screen.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+
+
+def when_ready(server):
+    if server.cfg.workers > 1 and not Config.LIVE_FEED_CHANGE_STREAM:
+        # Each worker only publishes the writes it handled itself
+        server.log.warning(
+            "%s workers without LIVE_FEED_CHANGE_STREAM: /accounting/daily/stream screens only see the "
+            "payments and expenses written through their own worker. Set LIVE_FEED_CHANGE_STREAM=true "
+            "(MongoDB replica set required) or run a single worker.", server.cfg.workers
+        )
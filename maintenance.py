@@ -0,0 +1,142 @@
+# maintenance.py
+#
+# Repairs derived data from the command line, e.g.:
+#   python maintenance.py rebuild-summaries [--schoolyear <id>]
+#   python maintenance.py rebuild-cumulative-totals
+#   python maintenance.py rebuild-daily-counters --from <YYYY-MM-DD> [--to <YYYY-MM-DD>]
+#   python maintenance.py validate-range --from <YYYY-MM-DD> [--to <YYYY-MM-DD>]
+#   python maintenance.py check-query-plans
+#   python maintenance.py rebuild-real-payments [--schoolyear <id>]
+
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+from mongoengine import connect
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+from config import Config  # Import Config after loading environment variables
+from models import SchoolYearPeriod
+
+
+# Connect to MongoDB using configuration from config.py
+def connect_db():
+    connect(
+        db=Config.MONGODB_SETTINGS['db'],
+        host=Config.MONGODB_SETTINGS['host']
+    )
+    print("Connected to MongoDB")
+
+
+def school_years(schoolyear_id=None):
+    if schoolyear_id:
+        return [SchoolYearPeriod.objects.get(id=schoolyear_id)]
+    return list(SchoolYearPeriod.objects.order_by('start_date'))
+
+
+def rebuild_summaries_command(args):
+    from utils.summaries import rebuild_summaries
+    from utils.versioning import bump_data_version
+
+    for school_year in school_years(args.schoolyear):
+        summaries = rebuild_summaries(school_year.id)
+        # Clients revalidating with an ETag must get the repaired numbers
+        bump_data_version(school_year.id)
+        print(f"Rebuilt {len(summaries)} monthly summaries for {school_year.name}")
+
+
+def rebuild_cumulative_totals_command(args):
+    from utils.daily_accounting import rebuild_cumulative_totals
+    from utils.versioning import bump_data_version, DAILY_ACCOUNTING_SCOPE
+
+    days = rebuild_cumulative_totals()
+    # The running web workers cache the daily reports under the daily accounting data version
+    bump_data_version(DAILY_ACCOUNTING_SCOPE)
+    print(f"Rebuilt the running totals of {days} validated days")
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def rebuild_daily_counters_command(args):
+    from utils.daily_counters import rebuild_daily_counter
+    from utils.versioning import bump_data_version
+
+    day = args.start
+    end = args.end or date.today()
+    while day <= end:
+        counter = rebuild_daily_counter(day)
+        print(f"{day}: {counter['payments_count']} payments, {counter['expenses_count']} depences")
+        day += timedelta(days=1)
+    bump_data_version()
+
+
+def validate_range_command(args):
+    from utils.daily_accounting import iter_close_days
+    from utils.versioning import bump_data_version, DAILY_ACCOUNTING_SCOPE
+
+    for progress in iter_close_days(args.start, args.end or date.today()):
+        print(f"{progress['done_days']}/{progress['days']} days: {progress['validated']} validated, {progress['skipped']} already validated")
+    bump_data_version(DAILY_ACCOUNTING_SCOPE)
+
+
+def check_query_plans_command(args):
+    from utils.query_plans import hot_queries, collection_scans
+
+    scans = collection_scans()
+    for name, _, _ in hot_queries():
+        print(f"{'COLLSCAN' if name in scans else 'indexed'}: {name}")
+    if scans:
+        sys.exit(1)
+
+
+def rebuild_real_payments_command(args):
+    from utils.ledger import rebuild_real_payments
+    from utils.versioning import bump_data_version
+    # The students_changed listeners of the app: the monthly summaries follow the projected amounts
+    import utils.summaries  # noqa: F401
+
+    for school_year in school_years(args.schoolyear):
+        drifted = rebuild_real_payments(school_year.id)
+        bump_data_version(school_year.id)
+        print(f"{school_year.name}: {len(drifted)} students had real payments differing from their payments")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GSP Finance maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rebuild = commands.add_parser('rebuild-summaries', help='Recompute MonthlySummary documents from students')
+    rebuild.add_argument('--schoolyear', help='SchoolYearPeriod id (default: every school year)')
+    rebuild.set_defaults(handler=rebuild_summaries_command)
+
+    cumulative = commands.add_parser('rebuild-cumulative-totals', help='Recompute the running totals of the validated days')
+    cumulative.set_defaults(handler=rebuild_cumulative_totals_command)
+
+    counters = commands.add_parser('rebuild-daily-counters', help='Recompute the live DailyCounter totals of a date range')
+    counters.add_argument('--from', dest='start', type=parse_date, required=True, help='First day (YYYY-MM-DD)')
+    counters.add_argument('--to', dest='end', type=parse_date, help='Last day (default: today)')
+    counters.set_defaults(handler=rebuild_daily_counters_command)
+
+    validate = commands.add_parser('validate-range', help='Validate every unvalidated day of a date range')
+    validate.add_argument('--from', dest='start', type=parse_date, required=True, help='First day (YYYY-MM-DD)')
+    validate.add_argument('--to', dest='end', type=parse_date, help='Last day (default: today)')
+    validate.set_defaults(handler=validate_range_command)
+
+    plans = commands.add_parser('check-query-plans', help='Explain the hot queries, exit 1 if one scans a whole collection')
+    plans.set_defaults(handler=check_query_plans_command)
+
+    real = commands.add_parser('rebuild-real-payments', help='Recompute the embedded real payments from the Payment collection')
+    real.add_argument('--schoolyear', help='Only this school year id (default: all)')
+    real.set_defaults(handler=rebuild_real_payments_command)
+
+    args = parser.parse_args()
+    connect_db()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
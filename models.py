@@ -3,7 +3,7 @@ from flask_mongoengine import MongoEngine
 from mongoengine import (
     Document, EmbeddedDocument, CASCADE, NULLIFY, PULL,
     StringField, DateTimeField, IntField, FloatField,
-    BooleanField, ListField, ReferenceField, EmbeddedDocumentField
+    BooleanField, ListField, ReferenceField, EmbeddedDocumentField, DictField
 )
 import bcrypt
 from datetime import datetime
@@ -159,12 +159,19 @@ class Student(Document):
     isSpecial = BooleanField(default=False)
     classe = ReferenceField('Classe', required=False, reverse_delete_rule=NULLIFY)  # Changed from required=True to required=False
     group = ReferenceField('Group', reverse_delete_rule=NULLIFY)
+    # Optimistic concurrency: bumped by every edit, with the version at which each field last changed
+    version = IntField(default=0)
+    field_versions = DictField()
 
     meta = {
         'collection': 'students',
         'indexes': [
             'name',
-            'school_year'
+            # Keyset pagination of a school year by name, and by classe then name
+            {'fields': ['school_year', 'name', 'id']},
+            {'fields': ['school_year', 'classe', 'name', 'id']},
+            # Cashier filters on left / new students
+            {'fields': ['school_year', 'isLeft', 'name']}
         ]
     }
 
@@ -200,9 +207,75 @@ class Student(Document):
             'left_date': self.left_date.isoformat() if self.left_date else None,
             'classe': classe_data,
             'group': str(self.group.id) if self.group else None,
-            'isSpecial': getattr(self, 'isSpecial', False)
+            'isSpecial': getattr(self, 'isSpecial', False),
+            'version': self.version or 0
         }
 
+class MonthlySummary(Document):
+    """Running totals of one school year month and payment kind, kept in sync on every write."""
+    school_year = ReferenceField('SchoolYearPeriod', required=True, reverse_delete_rule=CASCADE)
+    month = IntField(min_value=1, max_value=12, null=True)  # None for insurance
+    kind = StringField(choices=['tuition', 'transport', 'insurance'], required=True)
+    agreed = FloatField(default=0)
+    real = FloatField(default=0)
+    outstanding = FloatField(default=0)
+    student_count = IntField(default=0)  # Students with an agreed amount
+    unpaid_count = IntField(default=0)   # Students who paid less than agreed
+
+    meta = {
+        'collection': 'monthly_summaries',
+        'indexes': [
+            {'fields': ['school_year', 'month', 'kind'], 'unique': True}
+        ]
+    }
+
+    def to_json(self):
+        return {
+            'id': str(self.id),
+            'school_year': str(self.school_year.id) if self.school_year else None,
+            'month': self.month,
+            'kind': self.kind,
+            'agreed': self.agreed,
+            'real': self.real,
+            'outstanding': self.outstanding,
+            'student_count': self.student_count,
+            'unpaid_count': self.unpaid_count
+        }
+
+class DataVersion(Document):
+    """Counter bumped by every write to the data of a school year ('global' for data shared by all years)."""
+    key = StringField(required=True, unique=True)
+    version = IntField(default=0)
+
+    meta = {
+        'collection': 'data_versions'
+    }
+
+class IdempotencyKey(Document):
+    """
+    Response of a POST sent with an Idempotency-Key header, replayed when the
+    client retries. status_code stays empty while the first request runs,
+    which holds the key by its owner token until locked_until.
+    """
+    key = StringField(required=True)
+    endpoint = StringField(required=True)
+    request_hash = StringField()
+    owner = StringField()
+    locked_until = DateTimeField()
+    status_code = IntField()
+    body = StringField()
+    mimetype = StringField()
+    expires_at = DateTimeField(required=True)
+
+    meta = {
+        'collection': 'idempotency_keys',
+        'indexes': [
+            {'fields': ['key', 'endpoint'], 'unique': True},
+            # MongoDB removes each key once its expires_at is past
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0}
+        ]
+    }
+
 class Save(Document):
     student = ReferenceField('Student', required=True, reverse_delete_rule=CASCADE)
     user = ReferenceField('User', required=True, reverse_delete_rule=NULLIFY)
@@ -213,9 +286,13 @@ class Save(Document):
     meta = {
         'collection': 'saves',
         'indexes': [
-            'date',
             'types',
-            'student'
+            # Keyset pagination of the history, newest first: by date range alone,
+            # per student, per user and per changed field
+            {'fields': ['-date', '-id']},
+            {'fields': ['student', '-date', '-id']},
+            {'fields': ['user', '-date', '-id']},
+            {'fields': ['changes.field_name', '-date', '-id']}
         ]
     }
 
@@ -242,6 +319,10 @@ class Depence(Document):
     fixed_expenses = ListField(EmbeddedDocumentField(FixedExpense))  # List of fixed expenses for the month
     amount = FloatField(required=True)  # Total amount for all fixed expenses in that month
 
+    meta = {
+        'indexes': ['date']
+    }
+
     def to_json(self):
         return {
             "id": str(self.id),
@@ -274,7 +355,9 @@ class Payment(Document):
         'indexes': [
             'date',
             'payment_type',
-            'student'
+            # Equality fields first, the day range last: serves the "today's payment
+            # of a student for a type and month" lookup and, by prefix, per-student queries
+            ('student', 'payment_type', 'month', 'date')
         ]
     }
 
@@ -296,6 +379,11 @@ class DailyAccounting(Document):
     total_payments = FloatField(default=0)
     total_expenses = FloatField(default=0)
     net_profit = FloatField(default=0)
+    payments_by_type = DictField()  # payment_type -> total amount
+    payments_by_user = DictField()  # user id -> total amount
+    # Running totals of every validated day up to and including this one
+    cumulative_payments = FloatField(default=0)
+    cumulative_expenses = FloatField(default=0)
     isValidated = BooleanField(default=False)
 
     meta = {
@@ -319,5 +407,33 @@ class DailyAccounting(Document):
             'total_payments': self.total_payments,
             'total_expenses': self.total_expenses,
             'net_profit': self.net_profit,
+            'payments_by_type': self.payments_by_type,
+            'payments_by_user': self.payments_by_user,
             'isValidated': self.isValidated
         }
+
+class DailyCounter(Document):
+    """Live totals of a day, kept current with $inc by every payment and depence write."""
+    date = DateTimeField(required=True, unique=True)
+    total_payments = FloatField(default=0)
+    total_expenses = FloatField(default=0)
+    payments_count = IntField(default=0)
+    expenses_count = IntField(default=0)
+    payments_by_type = DictField()  # payment_type -> total amount
+    payments_by_user = DictField()  # user id -> total amount
+
+    meta = {
+        'collection': 'daily_counters'
+    }
+
+    def to_json(self):
+        return {
+            'date': self.date.isoformat(),
+            'total_payments': self.total_payments,
+            'total_expenses': self.total_expenses,
+            'net_profit': self.total_payments - self.total_expenses,
+            'payments_count': self.payments_count,
+            'expenses_count': self.expenses_count,
+            'payments_by_type': self.payments_by_type,
+            'payments_by_user': self.payments_by_user
+        }
@@ -1,10 +1,18 @@
 # accounting.py
 
-from flask import Blueprint, app, jsonify, request
-from models import Payment, Depence, DailyAccounting, Student
+from flask import Blueprint, app, jsonify, request, Response, current_app, has_app_context, stream_with_context
+from models import Payment, Depence, DailyAccounting, DailyCounter, Student
 from datetime import datetime, time
 from mongoengine import ValidationError
+from pymongo.errors import DuplicateKeyError
+import json
 import logging
+import threading
+from utils.helpers import parse_fields
+from utils.signals import daily_accounting_changed, payments_changed, depences_changed
+from utils.live_feed import EventBroker, watch_collections
+from utils.daily_accounting import close_day, close_days, iter_close_days
+from utils.daily_counters import day_of
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,95 +20,209 @@ logging.basicConfig(level=logging.INFO)
 # Create the blueprint for daily accounting routes
 accounting_bp = Blueprint('accounting_bp', __name__)
 
+# Payment fields selectable with the 'fields' query parameter ('id' is always returned)
+PAYMENT_FIELDS = ('student', 'user', 'date', 'amount', 'payment_type', 'month')
+
+def serialize_payment(raw, student_names, fields=None):
+    """
+    Builds the daily view of a payment from its raw Mongo document, with the
+    student replaced by its name, restricted to the requested fields when given.
+    """
+    payment = {'id': str(raw['_id'])}
+    for field in PAYMENT_FIELDS:
+        if fields is not None and field not in fields:
+            continue
+        value = raw.get(field)
+        if field == 'student':
+            value = student_names.get(value, str(value)) if value else None
+        elif field == 'user':
+            value = str(value) if value else None
+        elif field == 'date':
+            value = value.isoformat() if value else None
+        payment[field] = value
+    return payment
+
+def student_names_of(payments):
+    """Returns {student id: name} for raw payments, in one query."""
+    student_ids = {raw['student'] for raw in payments if raw.get('student')}
+    if not student_ids:
+        return {}
+    return {
+        student['_id']: student.get('name')
+        for student in Student.objects(id__in=list(student_ids)).only('name').as_pymongo()
+    }
+
+def today_activity(fields=None):
+    """Returns today's payments (restricted to the requested fields) and daily expenses."""
+    # Get today's date with time part set to 00:00:00
+    today_start = datetime.combine(datetime.now().date(), time.min)
+    today_end = datetime.combine(datetime.now().date(), time.max)
+
+    # Raw payments, with every student name resolved in one query
+    today_payments = Payment.objects(date__gte=today_start, date__lt=today_end)
+    if fields is not None:
+        today_payments = today_payments.only(*fields)
+    today_payments = list(today_payments.as_pymongo())
+    student_names = student_names_of(today_payments)
+
+    # Fetch only daily-type expenses made today
+    today_expenses = Depence.objects(type='daily', date__gte=today_start, date__lt=today_end)
+
+    return {
+        'payments': [serialize_payment(raw, student_names, fields) for raw in today_payments],
+        'expenses': [expense.to_json() for expense in today_expenses]
+    }
+
 # ------------------- Get Today's Payments and Expenses ----------------------------------------
 @accounting_bp.route('/daily/today', methods=['GET'])
 def get_today_payments_expenses(): 
     try:
-        logging.info("Entered get_today_payments_expenses")
-        # Get today's date with time part set to 00:00:00
-        today_start = datetime.combine(datetime.now().date(), time.min)
-        today_end = datetime.combine(datetime.now().date(), time.max)
-
-        logging.info(f"Fetching payments between {today_start} and {today_end}")
-        
-        # Fetch all payments made today
-        today_payments = Payment.objects(date__gte=today_start, date__lt=today_end)
-        payment_count = len(today_payments)
-        logging.info(f"Found {payment_count} payments")
-        
-        # Log payment details for debugging
-        for i, payment in enumerate(today_payments):
-            student_name = payment.student.name if payment.student else "Unknown"
-            logging.info(f"Payment {i+1}: Student={student_name}, Amount={payment.amount}, Type={payment.payment_type}, Date={payment.date}")
-        
-        payments_list = []
-        for payment in today_payments:
-            payment_data = payment.to_json()
-            # Fetch and include the student name
-            if payment.student:
-                payment_data['student'] = payment.student.name
-            payments_list.append(payment_data)
-
-        # Fetch only daily-type expenses made today
-        today_expenses = Depence.objects(type='daily', date__gte=today_start, date__lt=today_end)
-        expenses_list = [expense.to_json() for expense in today_expenses]
-
-        return jsonify({
-            'status': 'success',
-            'payments': payments_list,
-            'expenses': expenses_list
-        }), 200
+        # 'fields' restricts the loaded and returned payment fields, e.g. fields=amount,payment_type
+        fields = parse_fields(request.args.get('fields'), PAYMENT_FIELDS)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
+    try:
+        return jsonify(dict(today_activity(fields), status='success')), 200
     except Exception as e:
         logging.error(f"Error in get_today_payments_expenses: {e}")
         import traceback
         logging.error(traceback.format_exc())
         return jsonify({"status": "error", "message": str(e)}), 500
 
-# ------------------- Validate Daily Accounting for Today ----------------------------------------
+# ------------------- Live Totals of a Day ----------------------------------------
 
-@accounting_bp.route('/daily/validate', methods=['POST'])
-def validate_daily_accounting():
+@accounting_bp.route('/daily/live', methods=['GET'])
+def get_daily_live_totals():
+    """Running totals of today (or of 'date', YYYY-MM-DD) from its DailyCounter, in one lookup."""
     try:
-        # Get today's date with time part set to 00:00:00 and 23:59:59
-        today_start = datetime.combine(datetime.now().date(), time.min)
-        today_end = datetime.combine(datetime.now().date(), time.max)
+        date = datetime.strptime(request.args['date'], '%Y-%m-%d') if request.args.get('date') else datetime.now()
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid date format. Use YYYY-MM-DD."}), 400
 
-        # Check if the accounting for today has already been validated
-        existing_accounting = DailyAccounting.objects(date__gte=today_start, date__lt=today_end).first()
-        if existing_accounting and existing_accounting.isValidated:
-            return jsonify({"status": "error", "message": "Today's accounting has already been validated."}), 400
+    try:
+        counter = DailyCounter.objects(date=day_of(date)).first() or DailyCounter(date=day_of(date))
+        return jsonify({"status": "success", "data": counter.to_json()}), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        # Fetch today's payments and expenses
-        today_payments = Payment.objects(date__gte=today_start, date__lt=today_end)
-        today_expenses = Depence.objects(date__gte=today_start, date__lt=today_end)
+# ------------------- Live Feed of Today's Payments and Expenses ----------------------------------------
 
-        # Calculate totals
-        total_payments = sum(payment.amount for payment in today_payments)
-        total_expenses = sum(expense.amount for expense in today_expenses)
-        net_profit = total_payments - total_expenses
+# Open /daily/stream connections of this process
+live_feed = EventBroker()
+_change_stream = None
+_change_stream_lock = threading.Lock()
 
-        # Create or update the daily accounting for today
-        if existing_accounting:
-            existing_accounting.payments = today_payments
-            existing_accounting.daily_expenses = today_expenses
-            existing_accounting.total_payments = total_payments
-            existing_accounting.total_expenses = total_expenses
-            existing_accounting.net_profit = net_profit
-            existing_accounting.isValidated = True
-            existing_accounting.save()
-        else:
-            new_accounting = DailyAccounting(
-                date=today_start,
-                payments=today_payments,
-                daily_expenses=today_expenses,
-                total_payments=total_payments,
-                total_expenses=total_expenses,
-                net_profit=net_profit,
-                isValidated=True
-            )
-            new_accounting.save()
+def is_today(date):
+    return date is not None and date.date() == datetime.now().date()
+
+def publish_payment(action, raw, student_names=None):
+    """Sends a created, updated or deleted payment of today to the open streams."""
+    if not live_feed.has_subscribers:
+        return
+    if action == 'deleted':
+        live_feed.publish('payment', {'action': action, 'id': str(raw['_id'])})
+    elif is_today(raw.get('date')):
+        payment = serialize_payment(raw, student_names if student_names is not None else student_names_of([raw]))
+        live_feed.publish('payment', {'action': action, 'payment': payment})
+
+def publish_expense(action, raw):
+    """Sends a created, updated or deleted daily expense of today to the open streams."""
+    if not live_feed.has_subscribers:
+        return
+    if action == 'deleted':
+        live_feed.publish('expense', {'action': action, 'id': str(raw['_id'])})
+    elif raw.get('type') == 'daily' and is_today(raw.get('date')):
+        live_feed.publish('expense', {'action': action, 'expense': Depence._from_son(raw).to_json()})
+
+def _publish_change(publish, before, after, **kwargs):
+    # With a change stream every worker receives the writes from MongoDB instead
+    if has_app_context() and current_app.config.get('LIVE_FEED_CHANGE_STREAM'):
+        return
+    document = after if after is not None else before
+    if after is None and not is_today(before.get('date')):
+        return
+    action = 'created' if before is None else 'deleted' if after is None else 'updated'
+    try:
+        publish(action, document, **kwargs)
+    except Exception as e:
+        logging.error(f"Failed to publish a live feed event: {e}")
+
+@payments_changed.connect
+def _on_payments_changed(sender, before=None, after=None, changes=None, **kwargs):
+    if changes is None:
+        _publish_change(publish_payment, before, after)
+        return
+    if not live_feed.has_subscribers or (has_app_context() and current_app.config.get('LIVE_FEED_CHANGE_STREAM')):
+        return
+    # A batch looks the student names up once
+    try:
+        student_names = student_names_of([after for _, after in changes if after is not None])
+    except Exception as e:
+        logging.error(f"Failed to publish a live feed event: {e}")
+        return
+    for before, after in changes:
+        _publish_change(publish_payment, before, after, student_names=student_names)
+
+@depences_changed.connect
+def _on_depences_changed(sender, before=None, after=None, **kwargs):
+    _publish_change(publish_expense, before, after)
 
+def start_change_stream():
+    """Follows the payments and depences collections once per process (LIVE_FEED_CHANGE_STREAM)."""
+    global _change_stream
+    with _change_stream_lock:
+        if _change_stream is not None:
+            return
+        actions = {'insert': 'created', 'update': 'updated', 'replace': 'updated', 'delete': 'deleted'}
+        payments_collection = Payment._get_collection()
+
+        def on_change(collection_name, operation, document):
+            publish = publish_payment if collection_name == payments_collection.name else publish_expense
+            try:
+                publish(actions[operation], document)
+            except Exception as e:
+                logging.error(f"Failed to publish a live feed event: {e}")
+
+        _change_stream = watch_collections([payments_collection, Depence._get_collection()], on_change)
+
+@accounting_bp.route('/daily/stream', methods=['GET'])
+def stream_today_activity():
+    """
+    Server-sent events for the cashier screens: a 'snapshot' event with today's
+    payments and daily expenses, then 'payment' and 'expense' events with
+    action created, updated or deleted. Events racing the snapshot may repeat it.
+    """
+    if current_app.config.get('LIVE_FEED_CHANGE_STREAM'):
+        start_change_stream()
+
+    # Subscribe before reading the snapshot so that no write falls in between
+    subscription = live_feed.subscribe()
+    try:
+        snapshot = today_activity()
+    except Exception as e:
+        live_feed.unsubscribe(subscription)
+        logging.error(f"Error in stream_today_activity: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    heartbeat = current_app.config.get('LIVE_FEED_HEARTBEAT', 15)
+    response = Response(live_feed.stream(subscription, snapshot, heartbeat), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# ------------------- Validate Daily Accounting for Today ----------------------------------------
+
+@accounting_bp.route('/daily/validate', methods=['POST'])
+def validate_daily_accounting():
+    try:
+        # Totals are summed by MongoDB and written with one atomic upsert
+        try:
+            day = close_day(datetime.now().date())
+        except DuplicateKeyError:
+            return jsonify({"status": "error", "message": "Today's accounting has already been validated."}), 400
+
+        daily_accounting_changed.send(None, date=day['date'])
         return jsonify({"status": "success", "message": "Today's accounting has been validated."}), 201
 
     except ValidationError as e:
@@ -108,6 +230,56 @@ def validate_daily_accounting():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# ------------------- Validate a Range of Days ----------------------------------------
+
+@accounting_bp.route('/daily/validate_range', methods=['POST'])
+def validate_daily_accounting_range():
+    """
+    Validates every unvalidated day between start_date and end_date (inclusive,
+    YYYY-MM-DD, from the JSON body or the query string). With progress=true the
+    response streams one JSON line per chunk of days, then a final status line.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "The JSON body must be an object."}), 400
+    params = dict(request.args.to_dict(), **data)
+    try:
+        first_day = datetime.strptime(params['start_date'], '%Y-%m-%d').date()
+        last_day = datetime.strptime(params['end_date'], '%Y-%m-%d').date()
+    except KeyError as e:
+        return jsonify({"status": "error", "message": f"Missing field: {str(e)}"}), 400
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid date format. Use YYYY-MM-DD."}), 400
+
+    if last_day < first_day:
+        return jsonify({"status": "error", "message": "End date must not be before start date"}), 400
+    if last_day > datetime.now().date():
+        return jsonify({"status": "error", "message": "Future days cannot be validated."}), 400
+
+    if str(params.get('progress', 'false')).lower() in ('1', 'true', 'yes'):
+        def generate():
+            try:
+                for update in iter_close_days(first_day, last_day):
+                    yield json.dumps(update) + '\n'
+            except Exception as e:
+                logging.error(f"Error in validate_daily_accounting_range: {e}")
+                yield json.dumps({"status": "error", "message": str(e)}) + '\n'
+                return
+            finally:
+                # Sent even when the client disconnects after some days were written
+                daily_accounting_changed.send(None, date=None)
+            yield json.dumps(dict(update, status='success')) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    try:
+        result = close_days(first_day, last_day)
+        daily_accounting_changed.send(None, date=None)
+        return jsonify(dict(result, status='success')), 200
+    except Exception as e:
+        logging.error(f"Error in validate_daily_accounting_range: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 # ------------------- Get Daily Accounting Status ----------------------------------------
 
 @accounting_bp.route('/daily/status', methods=['GET'])
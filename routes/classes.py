@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify
 from models import Classe, Student
 from mongoengine.errors import NotUniqueError, ValidationError, DoesNotExist
+from collections import Counter
+from utils.payment_matrix import get_payment_matrix
+from utils.signals import students_changed, classes_changed
+from utils.decorators import etag_by_data_version
 
 # Use strict_slashes=False to handle both /classes and /classes/
 classes_bp = Blueprint('classes', __name__, url_prefix='/classes')
@@ -32,6 +36,7 @@ def create_class():
     try:
         classe = Classe(name=name, order=order)
         classe.save()
+        classes_changed.send(None)
         return jsonify({
             "status": "success",
             "data": classe_to_dict(classe)
@@ -78,6 +83,7 @@ def update_class(classe_id):
             return jsonify({"status": "error", "message": "No fields to update were provided"}), 400
             
         classe.save()
+        classes_changed.send(None)
         return jsonify({
             "status": "success",
             "data": classe_to_dict(classe)
@@ -104,11 +110,15 @@ def delete_class(classe_id):
             }), 400
             
         classe.delete()
+        classes_changed.send(None)
+        # Students of the class had their reference nullified
+        students_changed.send(None, before=None, after=None)
         return jsonify({"status": "success", "message": "Class deleted"}), 200
     except DoesNotExist:
         return jsonify({"status": "error", "message": "Class not found"}), 404
 
 @classes_bp.route('/counts', methods=['GET'], strict_slashes=False)
+@etag_by_data_version('school_year_id')
 def get_class_counts():
     """
     Get the count of students in each class for a specific school year period.
@@ -121,16 +131,11 @@ def get_class_counts():
     
     try:
         # Get all classes
-        classes = Classe.objects()
+        classes = Classe.objects().only('id')
         
-        # Create a dictionary to store counts
-        class_counts = {}
-        
-        # Count students for each class in the specified school year
-        for classe in classes:
-            # Query students directly with both class and school year filters
-            count = Student.objects(classe=classe.id, school_year=school_year_id).count()
-            class_counts[str(classe.id)] = count
+        # Count the students of each class from the cached payment matrix
+        students_per_class = Counter(get_payment_matrix(school_year_id).classe_ids)
+        class_counts = {str(classe.id): students_per_class.get(str(classe.id), 0) for classe in classes}
             
         return jsonify({
             "status": "success",
@@ -152,33 +157,32 @@ def debug_class_counts():
         # Get all classes
         classes = list(Classe.objects())
         
-        # Get students in the specified school year
-        all_students = list(Student.objects(school_year=school_year_id))
+        # Get students in the specified school year from the cached payment matrix
+        matrix = get_payment_matrix(school_year_id)
         
         debug_info = {
             "school_year_id": school_year_id,
             "total_classes": len(classes),
-            "total_students_in_year": len(all_students),
+            "total_students_in_year": len(matrix),
             "classes": [],
             "students_without_class": []
         }
         
         # Group students by class
         class_map = {}
-        for student in all_students:
-            if not student.classe:
+        for student_id, name, class_id in zip(matrix.ids, matrix.names, matrix.classe_ids):
+            if not class_id:
                 debug_info["students_without_class"].append({
-                    "id": str(student.id),
-                    "name": student.name
+                    "id": student_id,
+                    "name": name
                 })
                 continue
                 
-            class_id = str(student.classe.id)
             if class_id not in class_map:
                 class_map[class_id] = []
             class_map[class_id].append({
-                "id": str(student.id),
-                "name": student.name
+                "id": student_id,
+                "name": name
             })
         
         # Collect class info
@@ -220,6 +224,7 @@ def normalize_class_order():
             classe.order = new_order
             classe.save()
             updated_classes_data.append(classe_to_dict(classe))
+        classes_changed.send(None)
         
         return jsonify({
             "status": "success",
@@ -259,6 +264,9 @@ def batch_update_order():
             except (DoesNotExist, ValidationError) as e:
                 print(f"Error updating class {class_id}: {str(e)}")
         
+        if updated_ids:
+            classes_changed.send(None)
+
         all_classes = Classe.objects().order_by('order')
         
         return jsonify({
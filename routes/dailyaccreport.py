@@ -1,15 +1,103 @@
-from flask import Blueprint, jsonify, request
-from models import DailyAccounting
+from flask import Blueprint, jsonify, request, Response
+from models import DailyAccounting, Payment, Depence, Student
 from mongoengine import Q
 from datetime import datetime
+import json
+from utils.cache import cached_report
+from utils.daily_accounting import range_totals
 
 dailyacc_bp = Blueprint('dailyacc', __name__)
 
+# Number of days whose payments and expenses are fetched per round trip when streaming
+REPORT_BATCH_SIZE = 31
+
+
+def report_rows(records):
+    """
+    Builds the report rows of a batch of raw DailyAccounting documents with
+    three queries: their payments, the names of the paying students and their
+    expenses, instead of dereferencing every reference.
+    """
+    payment_ids = [payment_id for record in records for payment_id in record.get('payments', [])]
+    expense_ids = [expense_id for record in records for expense_id in record.get('daily_expenses', [])]
+
+    payments = {
+        payment['_id']: payment
+        for payment in Payment.objects(id__in=payment_ids)
+        .only('student', 'amount', 'payment_type', 'date').as_pymongo()
+    } if payment_ids else {}
+    student_ids = {payment.get('student') for payment in payments.values()}
+    student_names = {
+        student['_id']: student.get('name')
+        for student in Student.objects(id__in=list(student_ids)).only('name').as_pymongo()
+    } if student_ids else {}
+    expenses = {
+        expense['_id']: expense
+        for expense in Depence.objects(id__in=expense_ids).only('description', 'amount', 'date').as_pymongo()
+    } if expense_ids else {}
+
+    rows = []
+    for record in records:
+        payments_data = []
+        for payment_id in record.get('payments', []):
+            payment = payments.get(payment_id)
+            if payment is None:
+                continue
+            payments_data.append({
+                "student_name": student_names.get(payment.get('student')),
+                "amount": payment.get('amount'),
+                "payment_type": payment.get('payment_type'),
+                "date": payment['date'].isoformat()
+            })
+
+        expenses_data = []
+        for expense_id in record.get('daily_expenses', []):
+            expense = expenses.get(expense_id)
+            if expense is None:
+                continue
+            expenses_data.append({
+                "description": expense.get('description'),
+                "amount": expense.get('amount'),
+                "date": expense['date'].isoformat()
+            })
+
+        rows.append({
+            "date": record['date'].isoformat(),
+            "total_payments": record.get('total_payments', 0),
+            "total_expenses": record.get('total_expenses', 0),
+            "net_profit": record.get('net_profit', 0),
+            "details": {
+                "payments": payments_data,
+                "daily_expenses": expenses_data
+            }
+        })
+    return rows
+
+
+def stream_report(records):
+    """Yields the report response as JSON fragments, one batch of days at a time."""
+    yield '{"status": "success", "data": ['
+    separator = ''
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == REPORT_BATCH_SIZE:
+            yield separator + ','.join(json.dumps(row) for row in report_rows(batch))
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + ','.join(json.dumps(row) for row in report_rows(batch))
+    yield ']}'
+
+
 @dailyacc_bp.route('/daily_accounting_report', methods=['GET'])
+@cached_report()
 def daily_accounting_report():
     try:
         start_date_str = request.args.get('start_date')
         end_date_str = request.args.get('end_date')
+        # 'stream=true' sends long ranges (e.g. a school year export) in chunks
+        stream = request.args.get('stream', 'false').lower() in ('1', 'true', 'yes')
 
         if not start_date_str or not end_date_str:
             return jsonify({"status": "error", "message": "Start and end dates are required"}), 400
@@ -18,40 +106,42 @@ def daily_accounting_report():
         end_date = datetime.fromisoformat(end_date_str)
 
         # Query DailyAccounting data within the date range
-        daily_accounting_data = DailyAccounting.objects(Q(date__gte=start_date) & Q(date__lte=end_date))
-
-        report_data = []
-        for record in daily_accounting_data:
-            # Fetch detailed payment and expense data
-            payments_data = []
-            for payment in record.payments:
-                payments_data.append({
-                    "student_name": payment.student.name,
-                    "amount": payment.amount,
-                    "payment_type": payment.payment_type,
-                    "date": payment.date.isoformat()
-                })
-
-            expenses_data = []
-            for expense in record.daily_expenses:
-                expenses_data.append({
-                    "description": expense.description,
-                    "amount": expense.amount,
-                    "date": expense.date.isoformat()
-                })
-
-            report_data.append({
-                "date": record.date.isoformat(),
-                "total_payments": record.total_payments,
-                "total_expenses": record.total_expenses,
-                "net_profit": record.net_profit,
-                "details": {
-                    "payments": payments_data,
-                    "daily_expenses": expenses_data
-                }
-            })
+        daily_accounting_data = DailyAccounting.objects(
+            Q(date__gte=start_date) & Q(date__lte=end_date)
+        ).order_by('date').as_pymongo()
+
+        if stream:
+            daily_accounting_data = daily_accounting_data.batch_size(REPORT_BATCH_SIZE)
+            return Response(stream_report(daily_accounting_data), mimetype='application/json'), 200
+
+        return jsonify({"status": "success", "data": report_rows(list(daily_accounting_data))}), 200
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@dailyacc_bp.route('/range_totals', methods=['GET'])
+def get_range_totals():
+    """Totals of the validated days between start_date and end_date (inclusive), from the running totals."""
+    try:
+        start_date_str = request.args.get('start_date')
+        end_date_str = request.args.get('end_date')
+
+        if not start_date_str or not end_date_str:
+            return jsonify({"status": "error", "message": "Start and end dates are required"}), 400
+
+        start_date = datetime.fromisoformat(start_date_str)
+        end_date = datetime.fromisoformat(end_date_str)
+        if end_date < start_date:
+            return jsonify({"status": "error", "message": "End date must not be before start date"}), 400
 
-        return jsonify({"status": "success", "data": report_data}), 200
+        totals = range_totals(start_date, end_date)
+        return jsonify({
+            "status": "success",
+            "data": dict(totals, start_date=start_date.isoformat(), end_date=end_date.isoformat())
+        }), 200
 
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -6,6 +6,8 @@ from mongoengine import DoesNotExist, ValidationError
 from datetime import datetime, timezone
 from dateutil.relativedelta import relativedelta
 from bson import json_util
+from utils.helpers import snapshot
+from utils.signals import depences_changed
 
 depences_bp = Blueprint('depences', __name__)
 
@@ -64,6 +66,7 @@ def create_depence():
         )
         depence.save()
         depence_data = depence.to_mongo().to_dict()
+        depences_changed.send(None, before=None, after=depence_data)
         depence_json = json_util.dumps({"status": "success", "data": depence_data})
         return Response(depence_json, mimetype='application/json'), 201
     except KeyError as e:
@@ -82,9 +85,11 @@ def update_depence(depence_id):
         if 'date' in data:
             data['date'] = make_aware(datetime.strptime(data['date'], '%Y-%m-%d'))
         depence = Depence.objects.get(id=depence_id)
+        before = snapshot(depence)
         depence.update(**data)
         depence.reload()
         depence_data = depence.to_mongo().to_dict()
+        depences_changed.send(None, before=before, after=depence_data)
         depence_json = json_util.dumps({"status": "success", "data": depence_data})
         return Response(depence_json, mimetype='application/json'), 200
     except DoesNotExist:
@@ -100,7 +105,9 @@ def update_depence(depence_id):
 def delete_depence(depence_id):
     try:
         depence = Depence.objects.get(id=depence_id)
+        before = snapshot(depence)
         depence.delete()
+        depences_changed.send(None, before=before, after=None)
         success_response = json_util.dumps({"status": "success", "message": "Depence deleted"})
         return Response(success_response, mimetype='application/json'), 200
     except DoesNotExist:
@@ -271,11 +278,13 @@ def create_or_update_monthly_expenses(month_id):
 
         if depence:
             # If it exists, update the record
+            before = snapshot(depence)
             depence.fixed_expenses = fixed_expenses
             depence.amount = total_amount
             depence.description = f"Updated monthly expenses for {month_date.strftime('%B %Y')}"
             depence.save()
             depence_data = depence.to_mongo().to_dict()
+            depences_changed.send(None, before=before, after=depence_data)
             depence_json = json_util.dumps({"status": "success", "data": depence_data})
             return Response(depence_json, mimetype='application/json'), 200
         else:
@@ -289,6 +298,7 @@ def create_or_update_monthly_expenses(month_id):
             )
             new_depence.save()
             depence_data = new_depence.to_mongo().to_dict()
+            depences_changed.send(None, before=None, after=depence_data)
             depence_json = json_util.dumps({"status": "success", "data": depence_data})
             return Response(depence_json, mimetype='application/json'), 201
 
@@ -510,10 +520,12 @@ def populate_default_monthly_expenses():
             depence = Depence.objects(date=month_date).first()
 
             if depence:
+                before = snapshot(depence)
                 depence.fixed_expenses = [FixedExpense(**exp) for exp in expenses_list]
                 depence.amount = sum(exp["expense_amount"] for exp in expenses_list)
                 depence.description = f"Updated monthly expenses for {month_date.strftime('%B %Y')}"
                 depence.save()
+                depences_changed.send(None, before=before, after=snapshot(depence))
             else:
                 fixed_expenses = [FixedExpense(**exp) for exp in expenses_list]
                 total_amount = sum(exp["expense_amount"] for exp in expenses_list)
@@ -525,6 +537,7 @@ def populate_default_monthly_expenses():
                     amount=total_amount
                 )
                 new_depence.save()
+                depences_changed.send(None, before=None, after=snapshot(new_depence))
 
         success_response = json_util.dumps({"status": "success", "message": "Monthly expenses populated successfully."})
         return Response(success_response, mimetype='application/json'), 201
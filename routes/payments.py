@@ -3,9 +3,22 @@
 from flask import Blueprint, request, jsonify
 from models import Payment, Student, User, PaymentInfo, AgreedPayments, RealPayments, Save, ChangeDetail
 from mongoengine import DoesNotExist, ValidationError
+from mongoengine.errors import SaveConditionError
 from datetime import datetime, time
+from bson import ObjectId
+from pymongo import ReturnDocument
+from collections import Counter
+import copy
 import json
 import logging
+from utils.helpers import snapshot
+from utils.signals import students_changed, payments_changed
+from utils.decorators import idempotent
+from utils.ledger import ledger_mode, project_real_payments
+from utils.audit import record_save
+from utils.concurrency import (
+    MAX_UPDATE_ATTEMPTS, VersionConflict, parse_version, check_conflicts, versioned_save, conflict_response
+)
 
 payments_bp = Blueprint('payments', __name__)
 
@@ -28,188 +41,256 @@ def get_field(payment_type, month):
         return 'insurance_agreed'
     return None
 
-@payments_bp.route('/create_or_update', methods=['POST'])
-def create_or_update_payment():
-    data = request.get_json()
-    logging.info(f"Received data in create_or_update_payment: {data}")
-    
+# Month keys of a school year, in order
+MONTH_ORDER = ['m9', 'm10', 'm11', 'm12', 'm1', 'm2', 'm3', 'm4', 'm5', 'm6']
+
+def real_payment_fields(payment_type, month):
+    """
+    Returns the real field of a real payment and the agreed fields it may raise:
+    the agreed field of its month followed by those of the later months.
+    """
+    if payment_type == 'insurance':
+        return 'insurance_real', ['insurance_agreed']
+    if payment_type not in ('monthly', 'transport'):
+        raise ValidationError(f"Invalid payment_type: {payment_type}")
+
+    month_key = f"m{month}"
+    if month_key not in MONTH_ORDER:
+        raise ValidationError(f"Invalid month: {month}")
+    suffix = '' if payment_type == 'monthly' else '_transport'
+    later_months = MONTH_ORDER[MONTH_ORDER.index(month_key):]
+    return f"{month_key}{suffix}_real", [f"{key}{suffix}_agreed" for key in later_months]
+
+def parse_real_payment(data):
+    """
+    Validates the body of a real payment and returns its values with the
+    student fields it touches. Raises KeyError or ValidationError.
+    """
+    # Only handle REAL payments
+    if str(data.get('payment_type', '')).endswith('_agreed'):
+        raise ValidationError("This endpoint only handles REAL payments.")
+
+    # Validate required fields
+    required_fields = ['student_id', 'user_id', 'payment_type', 'amount']
+    for field in required_fields:
+        if field not in data:
+            logging.error(f"Missing required field: {field}")
+            raise KeyError(field)
+
+    student_id = data['student_id']
+    user_id = data['user_id']
+    payment_type = data['payment_type']
+    month = data.get('month')  # May be None for insurance payments
+
+    if not ObjectId.is_valid(student_id) or not ObjectId.is_valid(user_id):
+        raise ValidationError("Invalid student_id or user_id.")
     try:
-        # Log request headers for debugging
-        logging.info(f"Request headers: {dict(request.headers)}")
-        
-        # Only handle REAL payments
-        if data.get('payment_type', '').endswith('_agreed'):
-            raise ValidationError("This endpoint only handles REAL payments.")
-
-        # Validate required fields
-        required_fields = ['student_id', 'user_id', 'payment_type', 'amount']
-        for field in required_fields:
-            if field not in data:
-                logging.error(f"Missing required field: {field}")
-                raise KeyError(field)
-
-        # Retrieve student and user
-        student_id = data['student_id']
-        user_id = data['user_id']
-        payment_type = data['payment_type']
-        
-        try:
-            student = Student.objects.get(id=student_id)
-            logging.info(f"Found student: {student.name} (ID: {student_id})")
-        except DoesNotExist:
-            logging.error(f"Student not found: {student_id}")
-            raise DoesNotExist(f"Student with ID {student_id} not found")
-            
-        try:
-            user = User.objects.get(id=user_id)
-            logging.info(f"Found user: {user.username} (ID: {user_id})")
-        except DoesNotExist:
-            logging.error(f"User not found: {user_id}")
-            raise DoesNotExist(f"User with ID {user_id} not found")
-            
-        month = data.get('month')  # May be None for insurance payments
         amount = float(data['amount'])
-        
-        logging.info(f"Processing payment: Type={payment_type}, Month={month}, Amount={amount}")
-
-        # Validate 'month' field for non-insurance payments
-        if payment_type not in ['insurance'] and month is None:
-            logging.error("Month is required for non-insurance payments")
-            raise ValidationError("Field 'month' is required for non-insurance payments.")
-
-        # Determine the real and agreed payment field names
-        real_field = None
-        agreed_field = None
-        
-        if payment_type == 'monthly':
-            real_field = f"m{month}_real"
-            agreed_field = f"m{month}_agreed"
-        elif payment_type == 'transport':
-            real_field = f"m{month}_transport_real"
-            agreed_field = f"m{month}_transport_agreed"
-        elif payment_type == 'insurance':
-            real_field = 'insurance_real'
-            agreed_field = 'insurance_agreed'
-        else:
-            raise ValidationError(f"Invalid payment_type: {payment_type}")
-
-        # Find existing payment for the student in the specified month and type
+    except (TypeError, ValueError):
+        raise ValidationError(f"Invalid amount: {data['amount']}")
+    if amount < 0:
+        raise ValidationError("Field 'amount' must not be negative.")
+
+    # Validate 'month' field for non-insurance payments
+    if payment_type not in ['insurance'] and month is None:
+        logging.error("Month is required for non-insurance payments")
+        raise ValidationError("Field 'month' is required for non-insurance payments.")
+    if month is not None:
         try:
-            today_start = datetime.combine(datetime.now().date(), time.min)
-            today_end = datetime.combine(datetime.now().date(), time.max)
-            
-            logging.info(f"Checking for existing payments between {today_start} and {today_end}")
-            
-            existing_payment = Payment.objects(
-                student=student, 
-                payment_type=payment_type, 
-                month=month,
-                date__gte=today_start,
-                date__lt=today_end
-            ).first()
-            
-            if existing_payment:
-                logging.info(f"Found existing payment: {existing_payment.id}")
-            else:
-                logging.info("No existing payment found, will create new")
-        except Exception as e:
-            logging.error(f"Error checking for existing payments: {e}")
-            raise
-
-        # Make sure student has payment structures initialized
-        if not student.payments:
-            student.payments = PaymentInfo(agreed_payments=AgreedPayments(), real_payments=RealPayments())
-        if not student.payments.agreed_payments:
-            student.payments.agreed_payments = AgreedPayments()
-        if not student.payments.real_payments:
-            student.payments.real_payments = RealPayments()
+            month = int(month)
+        except (TypeError, ValueError):
+            raise ValidationError(f"Invalid month: {month}")
 
-        # Ensure real payment is not greater than agreed payment
-        # If it is, update agreed payment AND propagate to future months
-        changes = []
-        current_agreed_value = getattr(student.payments.agreed_payments, agreed_field, 0.0)
-        student_real_payment = getattr(student.payments.real_payments, real_field, 0.0)
-
-        # Update the real payment field on the student
-        setattr(student.payments.real_payments, real_field, amount)
-        changes.append(ChangeDetail(
-            field_name=f'real_payments.{real_field}', 
-            old_value=str(student_real_payment), 
-            new_value=str(amount)
-        ))
-
-        # If real > agreed, update agreed for this month and propagate to subsequent months
-        if amount > current_agreed_value:
-            setattr(student.payments.agreed_payments, agreed_field, amount)
+    try:
+        # The student version the client loaded, when it wants its payment rejected on a concurrent edit
+        version = parse_version(data.get('version'))
+    except (TypeError, ValueError):
+        raise ValidationError(f"Invalid version: {data.get('version')}")
+
+    real_field, agreed_fields = real_payment_fields(payment_type, month)
+    return {
+        'student': ObjectId(student_id),
+        'user': ObjectId(user_id),
+        'payment_type': payment_type,
+        'month': month,
+        'amount': amount,
+        'real_field': real_field,
+        'agreed_fields': agreed_fields,
+        'version': version
+    }
+
+def real_payment_pipeline(payment):
+    """
+    Update pipeline setting a real payment on a student. When the amount is
+    above the agreed amount of its month, that agreed amount and the later ones
+    are raised to it with $max; the condition is evaluated once, on the
+    document before the update. The student version is bumped and recorded
+    for the real field and, when raised, the agreed fields.
+    """
+    amount = payment['amount']
+    agreed_paths = [f'payments.agreed_payments.{field}' for field in payment['agreed_fields']]
+
+    update = {
+        f"payments.real_payments.{payment['real_field']}": amount,
+        f"field_versions.{payment['real_field']}": '$version'
+    }
+    for field, path in zip(payment['agreed_fields'], agreed_paths):
+        current = {'$ifNull': [f'${path}', 0]}
+        update[path] = {'$cond': ['$_raise_agreed', {'$max': [current, amount]}, current]}
+        update[f'field_versions.{field}'] = {
+            '$cond': ['$_raise_agreed', '$version', {'$ifNull': [f'$field_versions.{field}', 0]}]
+        }
+
+    return [
+        {'$set': {
+            '_raise_agreed': {'$gt': [amount, {'$ifNull': [f'${agreed_paths[0]}', 0]}]},
+            'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}
+        }},
+        {'$set': update},
+        {'$project': {'_raise_agreed': 0}}
+    ]
+
+def apply_real_payment(document, payment):
+    """Returns a copy of a raw student document with real_payment_pipeline applied."""
+    after = copy.deepcopy(document)
+    payments = after['payments'] = after.get('payments') or {}
+    real_payments = payments['real_payments'] = payments.get('real_payments') or {}
+    agreed_payments = payments['agreed_payments'] = payments.get('agreed_payments') or {}
+
+    field_versions = after['field_versions'] = after.get('field_versions') or {}
+    version = after['version'] = (after.get('version') or 0) + 1
+
+    amount = payment['amount']
+    raised = amount > (agreed_payments.get(payment['agreed_fields'][0]) or 0)
+    real_payments[payment['real_field']] = amount
+    field_versions[payment['real_field']] = version
+    for field in payment['agreed_fields']:
+        current = agreed_payments.get(field) or 0
+        agreed_payments[field] = max(current, amount) if raised else current
+        field_versions[field] = version if raised else field_versions.get(field) or 0
+    return after
+
+def today_payment_upsert(payment, payment_id, now):
+    """
+    Returns the (filter, update) upserting today's Payment of a student for a
+    type and month: the amount is set, the rest only written on insert.
+    """
+    today_start = datetime.combine(datetime.now().date(), time.min)
+    today_end = datetime.combine(datetime.now().date(), time.max)
+    return (
+        {
+            'student': payment['student'],
+            'payment_type': payment['payment_type'],
+            'month': payment['month'],
+            'date': {'$gte': today_start, '$lt': today_end}
+        },
+        {
+            '$set': {'amount': payment['amount']},
+            '$setOnInsert': {'_id': payment_id, 'user': payment['user'], 'date': now}
+        }
+    )
+
+def real_payment_changes(student_before, student_after, payment):
+    """
+    Returns the ChangeDetails of a real payment from the raw student before and
+    after it: the real amount, then the agreed amounts it raised.
+    """
+    real_payments = (student_before.get('payments') or {}).get('real_payments') or {}
+    changes = [ChangeDetail(
+        field_name=f"real_payments.{payment['real_field']}",
+        old_value=str(real_payments.get(payment['real_field'], 0)),
+        new_value=str(payment['amount'])
+    )]
+    agreed_before = (student_before.get('payments') or {}).get('agreed_payments') or {}
+    agreed_after = student_after['payments']['agreed_payments']
+    for field in payment['agreed_fields']:
+        if (agreed_before.get(field) or 0) != agreed_after[field]:
             changes.append(ChangeDetail(
-                field_name=f'agreed_payments.{agreed_field}', 
-                old_value=str(current_agreed_value), 
-                new_value=str(amount)
+                field_name=f'agreed_payments.{field}',
+                old_value=str(agreed_before.get(field, 0)),
+                new_value=str(agreed_after[field])
             ))
+    return changes
+
+def new_payment_document(payment, payment_id, now):
+    """The raw Payment document inserted by today_payment_upsert."""
+    return {
+        '_id': payment_id,
+        'student': payment['student'],
+        'user': payment['user'],
+        'date': now,
+        'amount': payment['amount'],
+        'payment_type': payment['payment_type'],
+        'month': payment['month']
+    }
+
+def payment_to_json(raw):
+    """Same output as Payment.to_json, from a raw document."""
+    return {
+        'id': str(raw['_id']),
+        'student': str(raw['student']) if raw.get('student') else None,
+        'user': str(raw['user']) if raw.get('user') else None,
+        'date': raw['date'].isoformat(),
+        'amount': raw['amount'],
+        'payment_type': raw['payment_type'],
+        'month': raw.get('month')
+    }
 
-            # Propagate to subsequent months if it's monthly or transport payment
-            if payment_type in ['monthly', 'transport'] and month is not None:
-                # Define month order for subsequent updates
-                MONTH_ORDER = ['m9', 'm10', 'm11', 'm12', 'm1', 'm2', 'm3', 'm4', 'm5', 'm6']
-                month_key = f"m{month}"
-
-                try:
-                    current_month_index = MONTH_ORDER.index(month_key)
-                    for i in range(current_month_index + 1, len(MONTH_ORDER)):
-                        subsequent_month = MONTH_ORDER[i]
-                        subsequent_agreed_field = None
-
-                        if payment_type == 'monthly':
-                            subsequent_agreed_field = f"{subsequent_month}_agreed"
-                        elif payment_type == 'transport':
-                            subsequent_agreed_field = f"{subsequent_month}_transport_agreed"
-
-                        if subsequent_agreed_field:
-                            old_subsequent_value = getattr(student.payments.agreed_payments, subsequent_agreed_field, 0.0)
-                            if amount > old_subsequent_value:
-                                setattr(student.payments.agreed_payments, subsequent_agreed_field, amount)
-                                changes.append(ChangeDetail(
-                                    field_name=f'agreed_payments.{subsequent_agreed_field}', 
-                                    old_value=str(old_subsequent_value), 
-                                    new_value=str(amount)
-                                ))
-                except ValueError:
-                    logging.error(f"Invalid month key: {month_key}")
-                except Exception as e:
-                    logging.error(f"Error updating subsequent months: {e}")
-
-        # Save the updated student record
-        if changes:
-            student.save()
-            logging.info(f"Updated student payment information with {len(changes)} changes")
-
-        # If payment exists, update it
-        if existing_payment:
-            old_amount = existing_payment.amount
-            existing_payment.amount = amount
-            existing_payment.save()
-            logging.info(f"Updated payment {existing_payment.id}: {old_amount} -> {amount}")
-            return jsonify({"status": "success", "data": existing_payment.to_json()}), 200
-
-        # If no payment exists, create a new one
-        else:
-            try:
-                new_payment = Payment(
-                    student=student,
-                    user=user,
-                    amount=amount,
-                    payment_type=payment_type,
-                    month=month,
-                    date=datetime.utcnow()
-                )
-                new_payment.save()
-                logging.info(f"Created new payment with ID: {new_payment.id}")
-                return jsonify({"status": "success", "data": new_payment.to_json()}), 201
-            except Exception as e:
-                logging.error(f"Error creating new payment: {e}")
-                import traceback
-                logging.error(traceback.format_exc())
-                raise
+@payments_bp.route('/create_or_update', methods=['POST'])
+@idempotent
+def create_or_update_payment():
+    data = request.get_json()
+    logging.info(f"Received data in create_or_update_payment: {data}")
+    
+    try:
+        payment = parse_real_payment(data)
+
+        if not User.objects(id=payment['user']).only('id').first():
+            logging.error(f"User not found: {data['user_id']}")
+            raise DoesNotExist(f"User with ID {data['user_id']} not found")
+
+        logging.info(f"Processing payment: Student={data['student_id']}, Type={payment['payment_type']}, Month={payment['month']}, Amount={payment['amount']}")
+
+        # 1st write: the real payment and the raised agreed amounts, atomically.
+        # With a version, only if the real field was not changed since that version
+        query = {'_id': payment['student']}
+        if payment['version'] is not None:
+            query[f"field_versions.{payment['real_field']}"] = {'$not': {'$gt': payment['version']}}
+        student_before = Student._get_collection().find_one_and_update(
+            query,
+            real_payment_pipeline(payment),
+            return_document=ReturnDocument.BEFORE
+        )
+        if student_before is None:
+            if payment['version'] is not None and Student.objects(id=payment['student']).only('id').first():
+                logging.info(f"Version conflict on student {data['student_id']} for {payment['real_field']}")
+                return jsonify(conflict_response(payment['student'], [payment['real_field']])), 409
+            logging.error(f"Student not found: {data['student_id']}")
+            raise DoesNotExist(f"Student with ID {data['student_id']} not found")
+        # Replay the update on the previous state instead of reading the document again
+        student_after = apply_real_payment(student_before, payment)
+        students_changed.send(None, before=[student_before], after=[student_after])
+        record_save(payment['student'], payment['user'], ['payment'], real_payment_changes(student_before, student_after, payment))
+
+        # 2nd write: today's payment of the student for this type and month, created or updated.
+        # Retries sent with an Idempotency-Key never get here; this match only merges same-day corrections
+        payment_id = ObjectId()
+        now = datetime.utcnow()
+        query, update = today_payment_upsert(payment, payment_id, now)
+        payment_before = Payment._get_collection().find_one_and_update(
+            query, update, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+
+        if payment_before is not None:
+            payment_after = dict(payment_before, amount=payment['amount'])
+            payments_changed.send(None, before=payment_before, after=payment_after)
+            logging.info(f"Updated payment {payment_before['_id']}: {payment_before.get('amount')} -> {payment['amount']}")
+            return jsonify({"status": "success", "data": payment_to_json(payment_after)}), 200
+
+        payment_after = new_payment_document(payment, payment_id, now)
+        payments_changed.send(None, before=None, after=payment_after)
+        logging.info(f"Created new payment with ID: {payment_id}")
+        return jsonify({"status": "success", "data": payment_to_json(payment_after)}), 201
 
     except KeyError as e:
         logging.error(f"KeyError: Missing field {e}")
@@ -226,8 +307,178 @@ def create_or_update_payment():
         logging.error(traceback.format_exc())
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Maximum number of payments accepted by one /payments/bulk request
+BULK_MAX_PAYMENTS = 500
+
+@payments_bp.route('/bulk', methods=['POST'])
+@idempotent
+def bulk_payments():
+    """
+    Records a list of real payments {"payments": [{student_id, user_id,
+    payment_type, month, amount}, ...]} with the rules of /create_or_update,
+    applied in list order. Students and users are resolved with one query
+    each; the payments of a student are applied with one version-conditioned
+    find_one_and_update, redone on the new state when another write landed
+    meanwhile, and each Payment is upserted with find_one_and_update so that
+    the derived data is updated from the documents as they were. The signals
+    are sent once for the whole batch. Returns one result per item: created,
+    updated or error.
+
+    An item with a version is rejected, with its conflicting field, when its
+    real field changed after that version. When a Payment write fails after
+    its student was written, the answer is 500 with the indexes of the items
+    whose Payment was not recorded; in ledger mode their students are
+    projected from the payments again, otherwise their real amounts stay applied.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('payments')
+    if not isinstance(items, list) or not items:
+        return jsonify({"status": "error", "message": "Field 'payments' must be a non-empty list."}), 400
+    if len(items) > BULK_MAX_PAYMENTS:
+        return jsonify({"status": "error", "message": f"At most {BULK_MAX_PAYMENTS} payments per request."}), 400
+
+    # Validate every item first; invalid items are reported and skipped
+    results = [None] * len(items)
+    parsed = {}
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError("Each payment must be an object.")
+            parsed[index] = parse_real_payment(item)
+        except KeyError as e:
+            results[index] = {"index": index, "status": "error", "message": f"Missing field: {str(e)}"}
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "error", "message": str(e)}
+
+    def conflict(index):
+        return {
+            "index": index, "status": "error", "conflicts": [parsed[index]['real_field']],
+            "message": "The student was modified by another user. Reload it and retry."
+        }
+
+    try:
+        student_ids = list({payment['student'] for payment in parsed.values()})
+        user_ids = list({payment['user'] for payment in parsed.values()})
+        students = {
+            document['_id']: document for document in Student.objects(id__in=student_ids).as_pymongo()
+        } if student_ids else {}
+        users = {
+            document['_id'] for document in User.objects(id__in=user_ids).only('id').as_pymongo()
+        } if user_ids else set()
+
+        # The items of each student, in list order
+        by_student = {}
+        for index in sorted(parsed):
+            payment = parsed[index]
+            if payment['student'] not in students:
+                results[index] = {"index": index, "status": "error", "message": f"Student with ID {items[index]['student_id']} not found"}
+            elif payment['user'] not in users:
+                results[index] = {"index": index, "status": "error", "message": f"User with ID {items[index]['user_id']} not found"}
+            else:
+                by_student.setdefault(payment['student'], []).append(index)
+
+        collection = Student._get_collection()
+        before, after, applied, audit_records = [], [], [], []
+        for student_id, indexes in by_student.items():
+            document = students[student_id]
+            for attempt in range(MAX_UPDATE_ATTEMPTS):
+                accepted = []
+                for index in indexes:
+                    payment = parsed[index]
+                    field_versions = document.get('field_versions') or {}
+                    if payment['version'] is not None and (field_versions.get(payment['real_field']) or 0) > payment['version']:
+                        results[index] = conflict(index)
+                    else:
+                        results[index] = None
+                        accepted.append(index)
+                if not accepted:
+                    break
+
+                # Only applied if the student is still in the state read: the deltas are computed from it
+                pipeline = [stage for index in accepted for stage in real_payment_pipeline(parsed[index])]
+                student_before = collection.find_one_and_update(
+                    {'_id': student_id, 'version': document.get('version')}, pipeline,
+                    return_document=ReturnDocument.BEFORE
+                )
+                if student_before is not None:
+                    state = student_before
+                    for index in accepted:
+                        payment_after = apply_real_payment(state, parsed[index])
+                        audit_records.append((parsed[index], real_payment_changes(state, payment_after, parsed[index])))
+                        state = payment_after
+                    before.append(student_before)
+                    after.append(state)
+                    applied.extend(accepted)
+                    break
+
+                document = collection.find_one({'_id': student_id})
+                if document is None:
+                    for index in accepted:
+                        results[index] = {"index": index, "status": "error", "message": f"Student with ID {items[index]['student_id']} not found"}
+                    break
+            else:
+                for index in accepted:
+                    results[index] = conflict(index)
+
+        if after:
+            students_changed.send(None, before=before, after=after)
+            for payment, changes in audit_records:
+                record_save(payment['student'], payment['user'], ['payment'], changes)
+
+        # Today's Payment of each applied item, created or updated, in list order
+        now = datetime.utcnow()
+        payment_events, unrecorded, payment_error = [], [], None
+        for index in sorted(applied):
+            payment = parsed[index]
+            payment_id = ObjectId()
+            query, update = today_payment_upsert(payment, payment_id, now)
+            try:
+                payment_before = Payment._get_collection().find_one_and_update(
+                    query, update, upsert=True, return_document=ReturnDocument.BEFORE
+                )
+            except Exception as e:
+                unrecorded.append(index)
+                payment_error = e
+                continue
+            if payment_before is not None:
+                payment_after = dict(payment_before, amount=payment['amount'])
+                status = 'updated'
+            else:
+                payment_after = new_payment_document(payment, payment_id, now)
+                status = 'created'
+            payment_events.append((payment_before, payment_after))
+            results[index] = {"index": index, "status": status, "data": payment_to_json(payment_after)}
+
+        if payment_events:
+            # One send for the batch: the daily counters take a single bulk_write
+            payments_changed.send(None, changes=payment_events)
+
+        if unrecorded:
+            logging.error(f"Bulk payments: items {unrecorded} applied to their students without a Payment: {payment_error}")
+            if ledger_mode():
+                project_real_payments({parsed[index]['student'] for index in unrecorded})
+            return jsonify({
+                "status": "error",
+                "message": f"Failed to record the payments: {payment_error}",
+                "unrecorded": unrecorded
+            }), 500
+
+    except Exception as e:
+        logging.error(f"Exception in bulk_payments: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    counts = Counter(result['status'] for result in results)
+    logging.info(f"Bulk payments: {counts['created']} created, {counts['updated']} updated, {counts['error']} failed")
+    return jsonify({
+        "status": "success",
+        "created": counts['created'],
+        "updated": counts['updated'],
+        "failed": counts['error'],
+        "results": results
+    }), 200
+
 @payments_bp.route('/agreed_changes', methods=['POST'])
-def agreed_changes():
+def agreed_changes(attempt=1):
     data = request.get_json()
     logging.info(f"Received data in agreed_changes: {data}")
     try:
@@ -237,21 +488,35 @@ def agreed_changes():
             if field not in data:
                 raise KeyError(field)
 
+        try:
+            # The student version the client loaded; without it the changes are applied unconditionally
+            expected_version = parse_version(data.get('version'))
+        except (TypeError, ValueError):
+            raise ValidationError(f"Invalid version: {data.get('version')}")
+
         student_id = data['student_id']
         user_id = data['user_id']
         agreed_payments = data['agreed_payments']  # Should be a dict with keys as field names
-        date = data['date']
+        try:
+            date = datetime.fromisoformat(str(data['date']).replace("Z", "+00:00"))
+        except ValueError:
+            raise ValidationError(f"Invalid date: {data['date']}")
+        if not isinstance(agreed_payments, dict):
+            raise ValidationError("Field 'agreed_payments' must be an object.")
+        for key in agreed_payments:
+            if not key.endswith('_agreed'):
+                raise ValidationError(f"Invalid agreed payment field: {key}")
 
         # Retrieve student and user
         student = Student.objects.get(id=student_id)
         user = User.objects.get(id=user_id)
+        before = snapshot(student)
 
-        # Ensure the student has a payments document
+        # Ensure the student has a payments document; saved with the changes below
         if not student.payments:
             student.payments = PaymentInfo()
             student.payments.agreed_payments = AgreedPayments()
             student.payments.real_payments = RealPayments()
-            student.save()
 
         # Fetch original agreed payments from the student data
         original_agreed = student.payments.agreed_payments.to_mongo().to_dict() if student.payments.agreed_payments else {}
@@ -261,14 +526,11 @@ def agreed_changes():
 
         # Iterate through agreed_payments and compare with original
         for key, new_value in agreed_payments.items():
-            if not key.endswith('_agreed'):
-                raise ValidationError(f"Invalid agreed payment field: {key}")
-
             old_value = original_agreed.get(key, 0)
             if new_value != old_value:
                 changes.append(
                     ChangeDetail(
-                        field_name=key,
+                        field_name=f'agreed_payments.{key}',
                         old_value=str(old_value),
                         new_value=str(new_value)
                     )
@@ -278,17 +540,11 @@ def agreed_changes():
 
         # Save the student document if there are changes
         if changes:
-            student.save()
-
-            # Create a Save record
-            # save_record = Save(
-            #     student=student,
-            #     user=user,
-            #     types=['agreed_payments'],
-            #     changes=changes,
-            #     date=datetime.fromisoformat(date.replace("Z", "+00:00"))  # Convert to datetime object
-            # )
-            # save_record.save()
+            check_conflicts(before.get('field_versions'), expected_version, changes)
+            versioned_save(student, changes)
+            students_changed.send(None, before=[before], after=[snapshot(student)])
+
+            record_save(student, user, ['payment'], changes, date=date)
 
             return jsonify({"status": "success", "message": "Agreed payments updated"}), 200
         else:
@@ -303,15 +559,38 @@ def agreed_changes():
     except ValidationError as e:
         logging.error(f"ValidationError: {e}")
         return jsonify({"status": "error", "message": str(e)}), 400
+    except VersionConflict as e:
+        return jsonify(conflict_response(data['student_id'], e.fields)), 409
+    except SaveConditionError:
+        # Another write landed between our read and this save: redo the changes on the new state
+        if attempt < MAX_UPDATE_ATTEMPTS:
+            return agreed_changes(attempt + 1)
+        return jsonify(conflict_response(data['student_id'])), 409
     except Exception as e:
         logging.error(f"Exception in agreed_changes: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @payments_bp.route('/<payment_id>', methods=['DELETE'])
-def delete_payment(payment_id):
+def delete_payment(payment_id, attempt=1):
     try:
         payment = Payment.objects.get(id=payment_id)
+
+        if ledger_mode():
+            # The real amount falls back to the student's previous payment, if any
+            payment_before = snapshot(payment)
+            change = ChangeDetail(
+                field_name=f'real_payments.{get_field(payment.payment_type, payment.month)}',
+                old_value=json.dumps(payment.to_json()),
+                new_value='deleted'
+            )
+            payment.delete()
+            payments_changed.send(None, before=payment_before, after=None)
+            project_real_payments([payment_before['student']])
+            record_save(payment_before['student'], payment_before.get('user'), ['payment'], [change])
+            return jsonify({"status": "success", "message": "Payment deleted"}), 200
+
         student = payment.student
+        before = snapshot(student)
         payment_type = payment.payment_type
         month = payment.month
 
@@ -332,27 +611,29 @@ def delete_payment(payment_id):
         setattr(payment_info.real_payments, field, 0)
 
         student.payments = payment_info
-        student.save()
+        try:
+            versioned_save(student, [ChangeDetail(field_name=field)])
+        except SaveConditionError:
+            # Another write landed since the student was read: redo the reset on the new state
+            if attempt < MAX_UPDATE_ATTEMPTS:
+                return delete_payment(payment_id, attempt + 1)
+            return jsonify(conflict_response(student.id, [field])), 409
+        students_changed.send(None, before=[before], after=[snapshot(student)])
 
         # Delete payment
+        payment_before = snapshot(payment)
         payment.delete()
+        payments_changed.send(None, before=payment_before, after=None)
 
         # Record the deletion
         changes = [
             ChangeDetail(
-                field_name=field,
+                field_name=f'real_payments.{field}',
                 old_value=json.dumps(original_payment_json),
                 new_value='0'  # Indicates reset
             )
         ]
-        # save_record = Save(
-        #     student=student,
-        #     user=payment.user,  # Ensure 'user' is correctly retrieved if needed
-        #     types=['payment'],
-        #     changes=changes,
-        #     date=datetime.utcnow()
-        # )
-        # save_record.save()
+        record_save(student, payment_before.get('user'), ['payment'], changes)
 
         return jsonify({"status": "success", "message": "Payment deleted"}), 200
     except DoesNotExist:
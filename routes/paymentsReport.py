@@ -1,12 +1,14 @@
 # routes/paymentsReport.py
 
 from flask import Blueprint, jsonify, request
-from models import Student, SchoolYearPeriod
-from collections import defaultdict
+from models import SchoolYearPeriod
+from utils.distribution_report import distribution_report, report_options
+from utils.cache import cached_report
 
 payments_report_bp = Blueprint('payments_report', __name__)
 
 @payments_report_bp.route('/payments-report', methods=['GET'])
+@cached_report(school_year_name_arg='school_year')
 def payments_report():
     """
     Generates a payments report filtered by school year, including:
@@ -16,6 +18,9 @@ def payments_report():
 
     Query Parameters:
     - school_year (str): The name of the school year period to filter the report.
+    - include_students (bool, optional): Set to false to omit the student lists.
+    - page, page_size (int, optional): Paginate the student lists by name.
+    - bucket_size (int, optional): Group the distribution into buckets of this width.
     """
     # Retrieve the school_year from query parameters
     school_year_name = request.args.get('school_year')
@@ -29,90 +34,46 @@ def payments_report():
     except SchoolYearPeriod.DoesNotExist:
         return jsonify({"error": f"SchoolYearPeriod with name '{school_year_name}' does not exist."}), 400
 
-    # Define the months mapping in desired order
-    months = [
-        (9, 'September'),
-        (10, 'October'),
-        (11, 'November'),
-        (12, 'December'),
-        (1, 'January'),
-        (2, 'February'),
-        (3, 'March'),
-        (4, 'April'),
-        (5, 'May'),
-        (6, 'June')
-    ]
-
-    # Initialize data structures
-    monthly_payment_data = {}
-    for _, month_name in months:
-        monthly_payment_data[month_name] = {
-            'students': [],
-            'total_agreed': 0,
-            'payment_statistics': {},
-            'payment_distribution': defaultdict(int)
-        }
-
-    # Fetch students enrolled in the specified school year
-    students = Student.objects(school_year=school_year)
-
-    for student in students:
-        # Access the agreed payments for this student
-        if not student.payments or not student.payments.agreed_payments:
-            continue  # Skip if no payments data
-
-        payments = student.payments.agreed_payments
+    try:
+        options = report_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        for month_num, month_name in months:
-            agreed_payment = getattr(payments, f'm{month_num}_agreed', 0)
-            agreed_payment_int = int(agreed_payment)
+    # Prepare the final report
+    report = {
+        'monthly_payment_data': distribution_report(school_year.id, 'tuition', **options)
+    }
 
-            if agreed_payment_int > 0:
-                # Update monthly payment data
-                monthly_payment_data[month_name]['students'].append({
-                    'id': str(student.id),
-                    'name': student.name,
-                    'agreed_payment': agreed_payment_int
-                })
-                monthly_payment_data[month_name]['total_agreed'] += agreed_payment_int
+    return jsonify(report), 200
 
-                # Collect payments for statistics
-                monthly_payment_data[month_name].setdefault('agreed_payments', []).append(agreed_payment_int)
-                # Count the payment amounts
-                monthly_payment_data[month_name]['payment_distribution'][agreed_payment_int] += 1
+@payments_report_bp.route('/insurance-report', methods=['GET'])
+@cached_report(school_year_name_arg='school_year')
+def insurance_report():
+    """
+    Generates an insurance report filtered by school year: the students with a
+    non-zero agreed insurance, its statistics and its distribution.
 
-    # Calculate payment statistics and format payment distribution per month
-    for _, month_name in months:
-        agreed_payments = monthly_payment_data[month_name].get('agreed_payments', [])
-        if agreed_payments:
-            average_agreed_payment = int(round(sum(agreed_payments) / len(agreed_payments)))
-            min_agreed_payment = min(agreed_payments)
-            max_agreed_payment = max(agreed_payments)
-        else:
-            average_agreed_payment = 0
-            min_agreed_payment = 0
-            max_agreed_payment = 0
+    Query Parameters: same as /payments-report.
+    """
+    # Retrieve the school_year from query parameters
+    school_year_name = request.args.get('school_year')
 
-        # Update payment statistics
-        monthly_payment_data[month_name]['payment_statistics'] = {
-            'average_agreed_payment': average_agreed_payment,
-            'min_agreed_payment': min_agreed_payment,
-            'max_agreed_payment': max_agreed_payment
-        }
+    if not school_year_name:
+        return jsonify({"error": "Missing 'school_year' query parameter."}), 400
 
-        # Format payment distribution
-        payment_distribution = monthly_payment_data[month_name]['payment_distribution']
-        monthly_payment_data[month_name]['payment_distribution'] = [
-            {'amount': amount, 'student_count': count}
-            for amount, count in sorted(payment_distribution.items())
-        ]
+    try:
+        # Fetch the SchoolYearPeriod document based on the provided name
+        school_year = SchoolYearPeriod.objects.get(name=school_year_name)
+    except SchoolYearPeriod.DoesNotExist:
+        return jsonify({"error": f"SchoolYearPeriod with name '{school_year_name}' does not exist."}), 400
 
-        # Remove agreed_payments list to clean up data
-        monthly_payment_data[month_name].pop('agreed_payments', None)
+    try:
+        options = report_options(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Prepare the final report
     report = {
-        'monthly_payment_data': monthly_payment_data
+        'insurance_data': distribution_report(school_year.id, 'insurance', **options)['Insurance']
     }
 
     return jsonify(report), 200
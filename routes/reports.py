@@ -1,75 +1,60 @@
 # routes/reports.py
 
 from flask import Blueprint, jsonify, request
-from models import Student, Depence, SchoolYearPeriod
+from models import Depence, SchoolYearPeriod, MonthlySummary
 from mongoengine import Q
 from datetime import datetime,timezone
-import json
 import logging
+import numpy as np
+from utils.payment_matrix import get_payment_matrix, SCHOOL_YEAR_MONTHS, AGREED_FIELDS, TUITION_COLUMNS, INSURANCE_COLUMN
+from utils.summaries import rebuild_summaries, ensure_summaries, SUMMARY_FIELDS
+from utils.decorators import etag_by_data_version
+from utils.versioning import bump_data_version
+from utils.cache import cached_report, invalidate_reports
 
 
 
 reports_bp = Blueprint('reports', __name__)
 
-def calculate_monthly_data(month_num, year, school_year_period_id):
-    """
-    Returns:
-      - month
-      - total_monthly_agreed_payments
-      - total_transport_agreed_payments
-      - total_expenses
-      - net_profit
-      - total_insurance_students
+def aggregate_agreed_totals(school_year_period_id):
     """
+    Sums the agreed tuition, transport and insurance amounts of every student in
+    the school year from the cached payment matrix.
 
-    # Totals
-    total_monthly_agreed_payments = 0
-    total_transport_agreed_payments = 0
-    total_insurance_students = 0
+    Returns a dict keyed like the AgreedPayments fields (m9_agreed,
+    m9_transport_agreed, ..., insurance_agreed) plus 'insurance_students', the
+    number of students whose insurance_agreed is greater than 0.
+    """
+    matrix = get_payment_matrix(school_year_period_id)
+    column_totals = matrix.agreed.sum(axis=0).tolist()
 
-    # Sum payments from all students in the given SchoolYearPeriod
-    students = Student.objects(school_year=school_year_period_id)
-    for student in students:
-        if student.payments and student.payments.agreed_payments:
-            monthly_payment = getattr(student.payments.agreed_payments, f'm{month_num}_agreed', 0)
-            transport_payment = getattr(student.payments.agreed_payments, f'm{month_num}_transport_agreed', 0)
-            total_monthly_agreed_payments += monthly_payment
-            total_transport_agreed_payments += transport_payment
+    totals = dict(zip(AGREED_FIELDS, column_totals))
+    totals['insurance_students'] = int((matrix.agreed[:, INSURANCE_COLUMN] > 0).sum())
+    return totals
 
-            # If insurance is paid
-            if student.payments.agreed_payments.insurance_agreed > 0:
-                total_insurance_students += 1
 
+def aggregate_monthly_expenses(start_year, end_year):
+    """
+    Returns Depence totals bucketed by (year, month) for the school year running
+    from September of start_year to June of end_year, using one range query.
+    """
     # Make start_date and end_date timezone-aware (UTC)
-    start_date = datetime(year, month_num, 1, tzinfo=timezone.utc)
-    if month_num == 12:
-        end_date = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
-    else:
-        end_date = datetime(year, month_num + 1, 1, tzinfo=timezone.utc)
-
-    print(f"Querying Depence from {start_date} to {end_date}")
-
-    # Sum expenses
-    expenses = Depence.objects(Q(date__gte=start_date) & Q(date__lt=end_date))
-    total_expenses = sum(dep.amount for dep in expenses)
-
-    print(f"Total expenses found: {total_expenses}")
-
-    total_payments = total_monthly_agreed_payments + total_transport_agreed_payments
-    net_profit = total_payments - total_expenses
-
-    return {
-        "month": month_num,
-        "total_monthly_agreed_payments": total_monthly_agreed_payments,
-        "total_transport_agreed_payments": total_transport_agreed_payments,
-        "total_expenses": total_expenses,
-        "net_profit": net_profit,
-        "total_insurance_students": total_insurance_students
-    }
+    start_date = datetime(start_year, 9, 1, tzinfo=timezone.utc)
+    end_date = datetime(end_year, 7, 1, tzinfo=timezone.utc)
 
+    pipeline = [
+        {'$group': {
+            '_id': {'year': {'$year': '$date'}, 'month': {'$month': '$date'}},
+            'total': {'$sum': '$amount'}
+        }}
+    ]
+    buckets = Depence.objects(Q(date__gte=start_date) & Q(date__lt=end_date)).aggregate(pipeline)
+    return {(row['_id']['year'], row['_id']['month']): row['total'] for row in buckets}
 
 
 @reports_bp.route('/normal_profit_report', methods=['GET'])
+@etag_by_data_version('schoolyear_id')
+@cached_report('schoolyear_id')
 def normal_profit_report():
     try:
         school_year_period_id = request.args.get('schoolyear_id')
@@ -80,27 +65,31 @@ def normal_profit_report():
         start_year = school_year_period.start_date.year  # e.g. 2024
         end_year = school_year_period.end_date.year      # e.g. 2025
 
-        report_data = []
-        # Months: 9..12 of start_year
-        for month_num in range(9, 13):
-            month_data = calculate_monthly_data(month_num, start_year, school_year_period_id)
-            report_data.append(month_data)
+        agreed_totals = aggregate_agreed_totals(school_year_period.id)
+        expenses_by_month = aggregate_monthly_expenses(start_year, end_year)
+        total_insurance_students = agreed_totals['insurance_students']
 
-        # Months: 1..6 of end_year
-        for month_num in range(1, 7):
-            month_data = calculate_monthly_data(month_num, end_year, school_year_period_id)
-            report_data.append(month_data)
+        report_data = []
+        # Months 9..12 belong to start_year, months 1..6 to end_year
+        for month_num in SCHOOL_YEAR_MONTHS:
+            year = start_year if month_num >= 9 else end_year
+            total_monthly_agreed_payments = agreed_totals[f'm{month_num}_agreed']
+            total_transport_agreed_payments = agreed_totals[f'm{month_num}_transport_agreed']
+            total_expenses = expenses_by_month.get((year, month_num), 0)
+            net_profit = total_monthly_agreed_payments + total_transport_agreed_payments - total_expenses
+
+            report_data.append({
+                "month": month_num,
+                "total_monthly_agreed_payments": total_monthly_agreed_payments,
+                "total_transport_agreed_payments": total_transport_agreed_payments,
+                "total_expenses": total_expenses,
+                "net_profit": net_profit,
+                "total_insurance_students": total_insurance_students
+            })
 
         # Calculate total insurance & students with insurance
-        total_insurance = sum(
-            s.payments.agreed_payments.insurance_agreed
-            for s in Student.objects(school_year=school_year_period_id)
-            if s.payments and s.payments.agreed_payments
-        )
-        total_students_with_insurance = Student.objects(
-            school_year=school_year_period_id,
-            payments__agreed_payments__insurance_agreed__gt=0
-        ).count()
+        total_insurance = agreed_totals['insurance_agreed']
+        total_students_with_insurance = total_insurance_students
 
         # Add a row for total insurance
         report_data.append({
@@ -123,6 +112,8 @@ def normal_profit_report():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @reports_bp.route('/unknown_agreed_payments', methods=['GET'])
+@etag_by_data_version('schoolyear_id')
+@cached_report('schoolyear_id')
 def unknown_agreed_payments():
     """Lists students who have all monthly agreed payments = 0."""
     try:
@@ -130,22 +121,13 @@ def unknown_agreed_payments():
         if not school_year_period_id:
             return jsonify({"status": "error", "message": "School Year Period ID is required"}), 400
 
-        unknown_students = Student.objects(
-            school_year=school_year_period_id,
-            isLeft=False,
-            payments__agreed_payments__m9_agreed=0,
-            payments__agreed_payments__m10_agreed=0,
-            payments__agreed_payments__m11_agreed=0,
-            payments__agreed_payments__m12_agreed=0,
-            payments__agreed_payments__m1_agreed=0,
-            payments__agreed_payments__m2_agreed=0,
-            payments__agreed_payments__m3_agreed=0,
-            payments__agreed_payments__m4_agreed=0,
-            payments__agreed_payments__m5_agreed=0,
-            payments__agreed_payments__m6_agreed=0
-        ).only('name').to_json()
-
-        unknown_students_list = json.loads(unknown_students)
+        matrix = get_payment_matrix(school_year_period_id)
+        no_agreed_tuition = ~matrix.is_left & (matrix.agreed[:, TUITION_COLUMNS] == 0).all(axis=1)
+
+        unknown_students_list = [
+            {'_id': {'$oid': matrix.ids[row]}, 'name': matrix.names[row]}
+            for row in np.flatnonzero(no_agreed_tuition)
+        ]
 
         return jsonify({
             "status": "success",
@@ -155,3 +137,68 @@ def unknown_agreed_payments():
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
+
+@reports_bp.route('/monthly_summary', methods=['GET'])
+@etag_by_data_version('schoolyear_id')
+@cached_report('schoolyear_id')
+def monthly_summary_report():
+    """Serves per-month report rows straight from the MonthlySummary documents."""
+    try:
+        school_year_period_id = request.args.get('schoolyear_id')
+        if not school_year_period_id:
+            return jsonify({"status": "error", "message": "School Year Period ID is required"}), 400
+
+        # Summaries only receive deltas: build them from the students on first access
+        if ensure_summaries(school_year_period_id):
+            bump_data_version(school_year_period_id)
+            invalidate_reports(school_year_period_id)
+
+        summaries = {
+            (summary['month'], summary['kind']): {field: summary.get(field, 0) for field in SUMMARY_FIELDS}
+            for summary in MonthlySummary.objects(school_year=school_year_period_id).as_pymongo()
+        }
+        empty = {field: 0 for field in SUMMARY_FIELDS}
+
+        report_data = []
+        for month_num in SCHOOL_YEAR_MONTHS:
+            tuition = summaries.get((month_num, 'tuition'), empty)
+            transport = summaries.get((month_num, 'transport'), empty)
+            report_data.append({
+                "month": month_num,
+                "tuition": tuition,
+                "transport": transport,
+                "total_paid": tuition['real'] + transport['real'],
+                "total_left": (tuition['agreed'] + transport['agreed']) - (tuition['real'] + transport['real'])
+            })
+
+        return jsonify({
+            "status": "success",
+            "data": report_data,
+            "insurance": summaries.get((None, 'insurance'), empty)
+        }), 200
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@reports_bp.route('/monthly_summary/rebuild', methods=['POST'])
+def rebuild_monthly_summary():
+    """Recomputes the MonthlySummary documents of a school year to repair drift."""
+    try:
+        school_year_period_id = request.args.get('schoolyear_id')
+        if not school_year_period_id:
+            return jsonify({"status": "error", "message": "School Year Period ID is required"}), 400
+
+        school_year_period = SchoolYearPeriod.objects.get(id=school_year_period_id)
+        summaries = rebuild_summaries(school_year_period.id)
+        bump_data_version(school_year_period.id)
+        invalidate_reports(school_year_period.id)
+
+        return jsonify({
+            "status": "success",
+            "message": f"Rebuilt {len(summaries)} monthly summaries for {school_year_period.name}."
+        }), 200
+
+    except SchoolYearPeriod.DoesNotExist:
+        return jsonify({"status": "error", "message": "School Year Period not found"}), 404
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
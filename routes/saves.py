@@ -2,8 +2,10 @@
 
 from flask import Blueprint, request, jsonify
 from models import Save, Student, User, ChangeDetail, db
-from mongoengine import DoesNotExist, ValidationError
-from datetime import datetime
+from mongoengine import DoesNotExist, ValidationError, Q
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+import base64
 import json
 
 saves_bp = Blueprint('saves', __name__)
@@ -37,10 +39,13 @@ def create_save():
             )
         ]
 
+        # Same types as the audit records of the write routes
+        payment_fields = ('agreed_payments.', 'real_payments.')
+        is_payment = field_name.startswith(payment_fields) or field_name.endswith(('_agreed', '_real'))
         save_record = Save(
             student=student,
             user=user,
-            types=['agreed_payment'],
+            types=['payment' if is_payment else 'other'],
             changes=changes,
             date=datetime.fromisoformat(date.replace("Z", "+00:00"))  # Convert to datetime object
         )
@@ -56,3 +61,124 @@ def create_save():
         return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# ----------------------------------------
+# Audit History
+# ----------------------------------------
+# Records returned by one page of the history, by default and at most
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def parse_object_id(name, value):
+    if not ObjectId.is_valid(value):
+        raise ValueError(f"Invalid {name}: {value}")
+    return ObjectId(value)
+
+def parse_date(name, value):
+    try:
+        date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value}")
+    # Dates are stored as naive UTC
+    return date.astimezone(timezone.utc).replace(tzinfo=None) if date.tzinfo else date
+
+def encode_cursor(raw):
+    values = {'date': raw['date'].isoformat(), 'id': str(raw['_id'])}
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(values['date']), ObjectId(values['id'])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor.")
+
+def history_filters(args, student_id=None):
+    """
+    Builds the history query from the optional filters student_id, user_id,
+    field_name, type, start_date and end_date (inclusive; a date without a
+    time covers that whole day).
+    Raises ValueError on malformed values.
+    """
+    query = Q()
+    student_id = student_id or args.get('student_id')
+    if student_id:
+        query &= Q(student=parse_object_id('student_id', student_id))
+    if args.get('user_id'):
+        query &= Q(user=parse_object_id('user_id', args['user_id']))
+    if args.get('field_name'):
+        query &= Q(changes__field_name=args['field_name'])
+    if args.get('type'):
+        query &= Q(types=args['type'])
+    if args.get('start_date'):
+        query &= Q(date__gte=parse_date('start_date', args['start_date']))
+    if args.get('end_date'):
+        end_date = parse_date('end_date', args['end_date'])
+        if len(args['end_date']) == len('YYYY-MM-DD'):
+            query &= Q(date__lt=end_date + timedelta(days=1))
+        else:
+            query &= Q(date__lte=end_date)
+    return query
+
+def history_page(query, limit, cursor):
+    """
+    Returns (raw records, next cursor) for one page of the history, newest
+    first. Paging on (date, _id) keeps every page on a (..., -date, -_id) index.
+    """
+    if cursor:
+        date, record_id = cursor
+        query &= Q(date__lt=date) | Q(date=date, id__lt=record_id)
+    rows = list(Save.objects(query).order_by('-date', '-id').limit(limit + 1).as_pymongo())
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(rows[limit - 1])
+    return rows, None
+
+def serialize_save(raw, usernames):
+    user_id = raw.get('user')
+    return {
+        'id': str(raw['_id']),
+        'student': str(raw['student']) if raw.get('student') else None,
+        'user': str(user_id) if user_id else None,
+        'username': usernames.get(user_id),
+        'date': raw['date'].isoformat(),
+        'types': raw.get('types', []),
+        'changes': raw.get('changes', [])
+    }
+
+def history_response(student_id=None):
+    try:
+        query = history_filters(request.args, student_id)
+        limit = int(request.args['limit']) if request.args.get('limit') else DEFAULT_PAGE_SIZE
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}.")
+        cursor = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        rows, next_cursor = history_page(query, limit, cursor)
+        # Resolve the usernames of the page with one query
+        user_ids = list({raw['user'] for raw in rows if raw.get('user')})
+        usernames = {
+            user['_id']: user.get('username')
+            for user in User.objects(id__in=user_ids).only('username').as_pymongo()
+        } if user_ids else {}
+        return jsonify({
+            "status": "success",
+            "data": [serialize_save(raw, usernames) for raw in rows],
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
+        }), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@saves_bp.route('/', methods=['GET'])
+def list_saves():
+    """Change history, newest first, filtered by student_id, user_id, field_name, type and date range; paged by limit and cursor."""
+    return history_response()
+
+@saves_bp.route('/student/<student_id>', methods=['GET'])
+def student_history(student_id):
+    """Change history of one student, with the same filters and paging as GET /saves/."""
+    return history_response(student_id)
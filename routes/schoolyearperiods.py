@@ -5,6 +5,10 @@ from models import SchoolYearPeriod, Student, PaymentInfo, AgreedPayments, RealP
 from mongoengine import DoesNotExist, ValidationError
 from datetime import datetime
 import json
+from utils.helpers import snapshot
+from utils.signals import students_changed
+from utils.versioning import bump_data_version
+from utils.cache import invalidate_reports
 
 schoolyearperiods_bp = Blueprint('schoolyearperiods', __name__)
 
@@ -94,6 +98,7 @@ def create_schoolyearperiod():
             # Bulk save all new students
             if new_students:
                 Student.objects.insert(new_students)
+                students_changed.send(None, before=[], after=[snapshot(student) for student in new_students])
 
         return jsonify({
             "status": "success",
@@ -139,6 +144,9 @@ def update_schoolyearperiod(schoolyear_id):
 
     try:
         school_year.save()
+        # Period dates drive the month windows of the reports
+        bump_data_version(school_year.id)
+        invalidate_reports(school_year.id)
         return jsonify({"status": "success", "data": school_year.to_json()}), 200
     except ValidationError as ve:
         return jsonify({"status": "error", "message": str(ve)}), 400
@@ -1,11 +1,21 @@
 # routes/students.py
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, session
 from models import PaymentInfo, Student, SchoolYearPeriod, User, Save, ChangeDetail, db, RealPayments, AgreedPayments, Classe
 from mongoengine import DoesNotExist, ValidationError, Q
+from mongoengine.errors import SaveConditionError
 from datetime import datetime
 import json
+import base64
 import traceback # Add traceback for better error logging
+from utils.helpers import snapshot, parse_fields, reference_id
+from utils.signals import students_changed
+from utils.decorators import etag_by_data_version
+from utils.ledger import ledger_mode, real_payments_of
+from utils.audit import record_save
+from utils.concurrency import (
+    MAX_UPDATE_ATTEMPTS, VersionConflict, parse_version, check_conflicts, versioned_save, conflict_response
+)
 
 students_bp = Blueprint('students', __name__, url_prefix='/students')
 
@@ -90,6 +100,7 @@ def create_student():
         classe=classe  # Add classe reference
     )
     student.save()
+    students_changed.send(None, before=[], after=[snapshot(student)])
 
     return jsonify({
         'message': 'Student created successfully.',
@@ -99,10 +110,223 @@ def create_student():
 # ----------------------------------------
 # Get All Students (with SchoolYearPeriod Filter)
 # ----------------------------------------
+# Number of students read from the cursor per round trip and per streamed chunk
+STREAM_BATCH_SIZE = 200
+
+# Maximum number of students returned by one page
+MAX_PAGE_SIZE = 500
+STUDENT_SORTS = ('name', 'classe', 'id')
+
+def classe_names():
+    """Maps every classe id to its name with a single query, in classe order."""
+    classes = Classe.objects.order_by('order', 'name').only('name').as_pymongo()
+    return {str(classe['_id']): classe.get('name') for classe in classes}
+
+def parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Invalid boolean value: {value}")
+
+# Students with at least one tuition, transport or insurance amount paid below the agreed amount
+HAS_UNPAID_QUERY = {'$expr': {'$or': [
+    {'$lt': [
+        {'$ifNull': [f'$payments.real_payments.{field.replace("_agreed", "_real")}', 0]},
+        {'$ifNull': [f'$payments.agreed_payments.{field}', 0]}
+    ]}
+    for field in AgreedPayments._fields
+]}}
+
+def student_filters(school_year, args):
+    """
+    Builds the query of the students list from the optional filters:
+    classe, group, isLeft, isNew, isSpecial and has_unpaid.
+    Raises ValueError on malformed values.
+    """
+    query = Q(school_year=school_year)
+    if args.get('classe'):
+        query &= Q(classe=args['classe'])
+    if args.get('group'):
+        query &= Q(group=args['group'])
+    for flag in ('isLeft', 'isNew', 'isSpecial'):
+        if args.get(flag):
+            query &= Q(**{flag: parse_bool(args[flag])})
+    if args.get('has_unpaid'):
+        if parse_bool(args['has_unpaid']):
+            query &= Q(__raw__=HAS_UNPAID_QUERY)
+        else:
+            query &= Q(__raw__={'$nor': [HAS_UNPAID_QUERY]})
+    return query
+
+def encode_cursor(sort, raw, classes=()):
+    values = {'sort': sort, 'id': str(raw['_id']), 'name': raw.get('name')}
+    if sort == 'classe':
+        # Students without an existing classe share the last group, None
+        classe_id = str(raw['classe']) if raw.get('classe') else None
+        values['classe'] = classe_id if classe_id in classes else None
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(sort, token):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(values, dict) or values.get('sort') != sort:
+        raise ValueError("Cursor does not match the requested sort.")
+    return values
+
+def after_name(cursor):
+    """Keyset condition on (name, _id) for the students after the cursor."""
+    return Q(name__gt=cursor['name']) | Q(name=cursor['name'], id__gt=cursor['id'])
+
+def students_page(query, sort, limit, cursor, classes, projection=None):
+    """
+    Returns (raw students, next cursor) for one page of the keyset pagination.
+
+    Sorting by classe walks the classes in their order (students without a
+    classe last) and pages each one by (name, _id), so every step stays on the
+    (school_year, classe, name, _id) index.
+    """
+    def fetch(page_query, *ordering):
+        students = Student.objects(page_query).order_by(*ordering)
+        if projection is not None:
+            students = students.only(*projection)
+        return list(students.limit(limit + 1 - len(rows)).as_pymongo())
+
+    rows = []
+    if sort == 'id':
+        if cursor:
+            query &= Q(id__gt=cursor['id'])
+        rows = fetch(query, 'id')
+    elif sort == 'name':
+        if cursor:
+            query &= after_name(cursor)
+        rows = fetch(query, 'name', 'id')
+    else:
+        classe_order = list(classes) + [None]
+        if cursor and cursor.get('classe') not in classe_order:
+            raise ValueError("Invalid cursor.")
+        start = classe_order.index(cursor['classe']) if cursor else 0
+
+        for position in range(start, len(classe_order)):
+            # The last group holds the students without a classe or whose classe was deleted
+            classe_id = classe_order[position]
+            classe_query = query & (Q(classe=classe_id) if classe_id is not None else Q(classe__nin=list(classes)))
+            if cursor and position == start:
+                classe_query &= after_name(cursor)
+            rows += fetch(classe_query, 'name', 'id')
+            if len(rows) > limit:
+                break
+
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(sort, rows[limit - 1], classes)
+    return rows, None
+
+def students_by_classe(query, classes, projection=None):
+    """
+    Yields the raw students of a query in classe order then by name, one
+    classe at a time, so that each step reads the (school_year, classe, name, _id)
+    index in batches. Students without a known classe come last.
+    """
+    def fetch(classe_query):
+        students = Student.objects(query & classe_query).order_by('name', 'id')
+        if projection is not None:
+            students = students.only(*projection)
+        return students.as_pymongo().batch_size(STREAM_BATCH_SIZE)
+
+    for classe_id in classes:
+        yield from fetch(Q(classe=classe_id))
+    yield from fetch(Q(classe__nin=list(classes)))
+
+def payments_to_dict(payments, embedded_class):
+    """Returns the stored payment amounts with the model defaults filled in."""
+    values = {field: embedded_class._fields[field].default for field in embedded_class._fields}
+    values.update(payments or {})
+    return values
+
+# Fields selectable with the 'fields' query parameter ('_id' is always returned)
+STUDENT_FIELDS = (
+    'name', 'school_year', 'isNew', 'isLeft', 'joined_month', 'observations',
+    'payments', 'payments.agreed_payments', 'payments.real_payments',
+    'left_date', 'isSpecial', 'classe', 'group', 'version'
+)
+
+def student_projection(fields, *required):
+    """Returns the document fields to load for the requested fields, or None for all of them."""
+    if fields is None:
+        return None
+    return sorted(set(fields) | set(required))
+
+def serialize_student(raw, classes, fields=None):
+    """
+    Builds the list representation of a student from its raw Mongo document,
+    restricted to the requested fields when given.
+    """
+    def wanted(field):
+        return fields is None or field in fields
+
+    student = {'_id': str(raw['_id'])}
+    if wanted('name'):
+        student['name'] = raw.get('name')
+    if wanted('school_year'):
+        student['school_year'] = str(raw['school_year'])
+    if wanted('isNew'):
+        student['isNew'] = raw.get('isNew', False)
+    if wanted('isLeft'):
+        student['isLeft'] = raw.get('isLeft', False)
+    if wanted('joined_month'):
+        student['joined_month'] = raw.get('joined_month', 9)
+    if wanted('observations'):
+        student['observations'] = raw.get('observations')
+
+    payments = raw.get('payments') or {}
+    if wanted('payments') or wanted('payments.agreed_payments') or wanted('payments.real_payments'):
+        student['payments'] = {}
+        if wanted('payments') or wanted('payments.agreed_payments'):
+            student['payments']['agreed_payments'] = payments_to_dict(payments.get('agreed_payments'), AgreedPayments)
+        if wanted('payments') or wanted('payments.real_payments'):
+            student['payments']['real_payments'] = payments_to_dict(payments.get('real_payments'), RealPayments)
+
+    if wanted('left_date'):
+        student['left_date'] = raw['left_date'].isoformat() if raw.get('left_date') else None
+    if wanted('isSpecial'):
+        student['isSpecial'] = raw.get('isSpecial', False)
+    if wanted('classe'):
+        # A classe that no longer exists is reported by id only
+        classe_id = raw.get('classe')
+        student['classe'] = {'id': str(classe_id), 'name': classes.get(str(classe_id), 'Unknown')} if classe_id else None
+    if wanted('group'):
+        group_id = raw.get('group')
+        student['group'] = str(group_id) if group_id else None
+    if wanted('version'):
+        student['version'] = raw.get('version', 0)
+    return student
+
+def stream_students(students, classes, fields=None):
+    """Yields the students list response as JSON fragments, one batch at a time."""
+    yield '{"message": "Students retrieved successfully.", "students": ['
+    separator = ''
+    batch = []
+    for raw in students:
+        batch.append(json.dumps(serialize_student(raw, classes, fields)))
+        if len(batch) == STREAM_BATCH_SIZE:
+            yield separator + ','.join(batch)
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + ','.join(batch)
+    yield ']}'
+
 @students_bp.route('/', methods=['GET'])
+@etag_by_data_version('schoolyearperiod')
 def get_students():
     # Get the 'schoolyearperiod' query parameter
     school_year_id = request.args.get('schoolyearperiod', None)
+    # 'stream=true' sends the list in chunks instead of building it in memory
+    stream = request.args.get('stream', 'false').lower() in ('1', 'true', 'yes')
+    # 'limit' switches to keyset pagination, continued with 'cursor'
+    sort = request.args.get('sort')
 
     if not school_year_id:
         # Return an error if 'schoolyearperiod' is not provided
@@ -111,55 +335,52 @@ def get_students():
     try:
         # Validate the SchoolYearPeriod ID
         school_year = SchoolYearPeriod.objects.get(id=school_year_id)
-        
-        # Fetch students with classe data
-        students = Student.objects(school_year=school_year)
-        
-        # Convert to JSON manually to handle the classe reference properly
-        students_data = []
-        for student in students:
-            # Get basic student data
-            student_dict = {
-                '_id': str(student.id),
-                'name': student.name,
-                'school_year': str(student.school_year.id),
-                'isNew': student.isNew,
-                'isLeft': student.isLeft,
-                'joined_month': student.joined_month,
-                'observations': student.observations,
-                'payments': {
-                    'agreed_payments': student.payments.agreed_payments.to_mongo(),
-                    'real_payments': student.payments.real_payments.to_mongo()
-                },
-                'left_date': student.left_date.isoformat() if student.left_date else None,
-                'isSpecial': getattr(student, 'isSpecial', False)
-            }
-            
-            # Handle classe reference - fetch it separately to avoid errors
-            if student.classe:
-                try:
-                    classe = student.classe
-                    student_dict['classe'] = {
-                        'id': str(classe.id),
-                        'name': classe.name
-                    }
-                except Exception as e:
-                    # If there's an error fetching classe details, just include the ID
-                    student_dict['classe'] = {
-                        'id': str(student.classe.id),
-                        'name': 'Unknown'
-                    }
-            else:
-                student_dict['classe'] = None
-                
-            # Handle group reference
-            if hasattr(student, 'group') and student.group:
-                student_dict['group'] = str(student.group.id)
-            else:
-                student_dict['group'] = None
-                
-            students_data.append(student_dict)
-        
+
+        try:
+            query = student_filters(school_year, request.args)
+            if sort is not None and sort not in STUDENT_SORTS:
+                raise ValueError(f"Invalid sort. Use one of: {', '.join(STUDENT_SORTS)}.")
+            limit = int(request.args['limit']) if request.args.get('limit') else None
+            if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}.")
+            cursor = decode_cursor(sort or 'name', request.args['cursor']) if request.args.get('cursor') else None
+            # 'fields' restricts the loaded and returned fields, e.g. fields=name,classe
+            fields = parse_fields(request.args.get('fields'), STUDENT_FIELDS)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+
+        # Resolve classe names from one lookup table
+        classes = classe_names() if fields is None or 'classe' in fields or sort == 'classe' else {}
+
+        if limit is not None:
+            # The sort keys are always loaded to build the next cursor
+            projection = student_projection(fields, 'name', 'classe')
+            rows, next_cursor = students_page(query, sort or 'name', limit, cursor, classes, projection)
+            return jsonify({
+                "message": "Students retrieved successfully.",
+                "students": [serialize_student(raw, classes, fields) for raw in rows],
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None
+            }), 200
+
+        # Fetch raw student documents
+        if sort == 'classe':
+            students = students_by_classe(query, classes, student_projection(fields))
+        else:
+            students = Student.objects(query)
+            if sort == 'name':
+                students = students.order_by('name', 'id')
+            elif sort == 'id':
+                students = students.order_by('id')
+            projection = student_projection(fields)
+            if projection is not None:
+                students = students.only(*projection)
+            students = students.as_pymongo().batch_size(STREAM_BATCH_SIZE)
+
+        if stream:
+            return Response(stream_students(students, classes, fields), mimetype='application/json'), 200
+
+        students_data = [serialize_student(raw, classes, fields) for raw in students]
         return jsonify({"message": "Students retrieved successfully.", "students": students_data}), 200
     except DoesNotExist:
         return jsonify({"message": "School Year Period not found."}), 404
@@ -170,14 +391,34 @@ def get_students():
             "traceback": traceback.format_exc()
         }), 500
 
+def with_ledger_real_payments(student, student_id, school_year_id):
+    """In ledger mode, replaces the embedded real amounts of a serialized student by the ledger's."""
+    if ledger_mode() and 'real_payments' in (student.get('payments') or {}):
+        student['payments']['real_payments'] = real_payments_of(student_id, school_year_id)
+    return student
+
 # ----------------------------------------
 # Get a Specific Student by ID
 # ----------------------------------------
 @students_bp.route('/<student_id>', methods=['GET'])
 def get_student(student_id):
     try:
+        # 'fields' restricts the loaded and returned fields, e.g. fields=name,classe
+        fields = parse_fields(request.args.get('fields'), STUDENT_FIELDS)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        if fields is not None:
+            raw = Student.objects(id=student_id).only(*student_projection(fields, 'school_year')).as_pymongo().first()
+            if raw is None:
+                raise DoesNotExist()
+            classes = classe_names() if 'classe' in fields else {}
+            student = with_ledger_real_payments(serialize_student(raw, classes, fields), raw['_id'], raw.get('school_year'))
+            return jsonify({"message": "Student retrieved successfully.", "student": student}), 200
+
         student = Student.objects.get(id=student_id)
-        return jsonify({"message": "Student retrieved successfully.", "student": json.loads(student.to_json())}), 200
+        return jsonify({"message": "Student retrieved successfully.", "student": with_ledger_real_payments(student.to_json(), student.id, reference_id(student, 'school_year'))}), 200
     except DoesNotExist:
         return jsonify({'message': 'Student not found.'}), 404
     except Exception as e:
@@ -187,10 +428,20 @@ def get_student(student_id):
 # Update a Student
 # ----------------------------------------
 @students_bp.route('/<student_id>', methods=['PUT'])
-def update_student(student_id):
+def update_student(student_id, attempt=1):
     data = request.get_json()
+    try:
+        # 'version' is the version the client loaded; without it the edit is applied unconditionally
+        expected_version = parse_version(data.get('version'))
+    except (TypeError, ValueError):
+        return jsonify({'message': f"Invalid version: {data.get('version')}"}), 400
+    if ledger_mode() and ((data.get('payments') or {}).get('real_payments')):
+        # The real amounts are a projection of the Payment collection: record payments instead
+        return jsonify({'message': 'Real payments cannot be edited in ledger mode; use /payments/create_or_update.'}), 400
+
     try:
         student = Student.objects.get(id=student_id)
+        before = snapshot(student)
         # Ensure payments structure exists and initialize if necessary
         if not student.payments:
             student.payments = PaymentInfo(agreed_payments=AgreedPayments(), real_payments=RealPayments())
@@ -373,10 +624,27 @@ def update_student(student_id):
                         current_val = 0.0
                     setattr(student.payments.real_payments, field, float(current_val))
             
+            # Merged when none of the changed fields were modified since the client's version
+            check_conflicts(before.get('field_versions'), expected_version, changes)
+
             print(f"SAVE: Saving student {student_id} with {len(changes)} changes")
-            student.save()
+            versioned_save(student, changes)
+            students_changed.send(None, before=[before], after=[snapshot(student)])
             print(f"SAVE: Student {student_id} saved successfully")
+
+            # Audit trail: the editing user comes from the body or the login session, when known
+            user_id = data.get('user_id') or (session.get('user') or {}).get('id')
+            payment_fields = ('agreed_payments.', 'real_payments.')
+            types = sorted({'payment' if change.field_name.startswith(payment_fields) else 'other' for change in changes})
+            record_save(student, user_id, types, changes)
             
+        except VersionConflict as e:
+            return jsonify(conflict_response(student_id, e.fields)), 409
+        except SaveConditionError:
+            # Another write landed between our read and this save: redo the edit on the new state
+            if attempt < MAX_UPDATE_ATTEMPTS:
+                return update_student(student_id, attempt + 1)
+            return jsonify(conflict_response(student_id)), 409
         except ValidationError as e:
             print(f"VALIDATION ERROR: {str(e)}")
             traceback.print_exc()
@@ -391,7 +659,7 @@ def update_student(student_id):
         # Re-fetch the student to ensure the response reflects all saved changes
         updated_student = Student.objects.get(id=student_id)
         # Use the model's to_json method for consistent output
-        response_student_dict = json.loads(updated_student.to_json())
+        response_student_dict = updated_student.to_json()
         return jsonify({
             'message': 'Student updated successfully.',
             'student': response_student_dict
@@ -406,11 +674,24 @@ def update_student(student_id):
         # Return success but indicate potential response issue
         return jsonify({'message': 'Student updated successfully (response formatting error).'}), 200
 
+def left_changes(before, student):
+    """ChangeDetails of a student flagged as left: isLeft, left_date and the agreed amounts that changed."""
+    changes = [
+        ChangeDetail(field_name='isLeft', old_value=str(before.get('isLeft')), new_value=str(student.isLeft)),
+        ChangeDetail(field_name='left_date', old_value=str(before.get('left_date')), new_value=str(student.left_date))
+    ]
+    old_agreed = (before.get('payments') or {}).get('agreed_payments') or {}
+    new_agreed = student.payments.agreed_payments.to_mongo().to_dict() if student.payments and student.payments.agreed_payments else {}
+    for key, value in new_agreed.items():
+        if not key.startswith('_') and old_agreed.get(key) != value:
+            changes.append(ChangeDetail(field_name=f'agreed_payments.{key}', old_value=str(old_agreed.get(key, 0)), new_value=str(value)))
+    return changes
+
 # ----------------------------------------
 # Flag a Student as Left
 # ----------------------------------------
 @students_bp.route('/<student_id>/delete', methods=['PUT'])
-def flag_student_left(student_id):
+def flag_student_left(student_id, attempt=1):
     try:
         student = Student.objects.get(id=student_id)
     except DoesNotExist:
@@ -419,6 +700,7 @@ def flag_student_left(student_id):
     if student.isLeft:
         return jsonify({'message': 'Student is already flagged as left.'}), 400
 
+    before = snapshot(student)
     student.isLeft = True
     student.left_date = datetime.utcnow()
 
@@ -436,10 +718,52 @@ def flag_student_left(student_id):
     except Exception as e:
         return jsonify({'message': 'Failed to process real payments.', 'error': str(e)}), 500
 
-    student.save()
+    try:
+        versioned_save(student, left_changes(before, student))
+    except SaveConditionError:
+        # Another write landed since the student was read: map the amounts again from the new state
+        if attempt < MAX_UPDATE_ATTEMPTS:
+            return flag_student_left(student_id, attempt + 1)
+        return jsonify(conflict_response(student_id)), 409
+    students_changed.send(None, before=[before], after=[snapshot(student)])
 
     return jsonify({'message': 'Student flagged as left successfully.'}), 200
 
+def mark_student_left(student):
+    """
+    Flags a loaded student as left and maps its real amounts onto its agreed
+    amounts, in memory. Returns the snapshot taken before.
+    """
+    before = snapshot(student)
+    student.isLeft = True
+    student.left_date = datetime.utcnow()
+
+    # Map real payments to agreed payments
+    if student.payments and student.payments.real_payments:
+        real_payments_dict = student.payments.real_payments.to_mongo().to_dict()
+        # Filter out internal mongo keys like '_id' if they exist
+        real_payments_dict_clean = {k: v for k, v in real_payments_dict.items() if not k.startswith('_')}
+
+        agreed_payments_dict = {
+            key.replace('_real', '_agreed'): value
+            for key, value in real_payments_dict_clean.items()
+        }
+        # Ensure the target AgreedPayments object exists
+        if not student.payments.agreed_payments:
+             student.payments.agreed_payments = AgreedPayments()
+        # Update fields individually to handle potential schema differences
+        for key, value in agreed_payments_dict.items():
+             setattr(student.payments.agreed_payments, key, value)
+    else:
+        # Handle case where payments structure might be missing
+        print(f"Warning: Real payments data missing for student {student.id}. Cannot map to agreed.")
+        # Optionally initialize agreed payments to zero or skip
+        if not student.payments:
+            student.payments = PaymentInfo()
+        if not student.payments.agreed_payments:
+            student.payments.agreed_payments = AgreedPayments() # Initialize empty/zeroed
+    return before
+
 # ----------------------------------------
 # Batch Mark Students as Left
 # ----------------------------------------
@@ -454,45 +778,31 @@ def batch_mark_left():
     updated_count = 0
     errors = []
     updated_students_list = []
+    before_documents = []
+    after_documents = []
 
     try:
         students_to_update = Student.objects(id__in=student_ids)
 
         for student in students_to_update:
             if not student.isLeft:
-                student.isLeft = True
-                student.left_date = datetime.utcnow()
-
-                # Map real payments to agreed payments
                 try:
-                    if student.payments and student.payments.real_payments:
-                        real_payments_dict = student.payments.real_payments.to_mongo().to_dict()
-                        # Filter out internal mongo keys like '_id' if they exist
-                        real_payments_dict_clean = {k: v for k, v in real_payments_dict.items() if not k.startswith('_')}
-
-                        agreed_payments_dict = {
-                            key.replace('_real', '_agreed'): value
-                            for key, value in real_payments_dict_clean.items()
-                        }
-                        # Ensure the target AgreedPayments object exists
-                        if not student.payments.agreed_payments:
-                             student.payments.agreed_payments = AgreedPayments()
-                        # Update fields individually to handle potential schema differences
-                        for key, value in agreed_payments_dict.items():
-                             setattr(student.payments.agreed_payments, key, value)
-
-                    else:
-                        # Handle case where payments structure might be missing
-                        print(f"Warning: Real payments data missing for student {student.id}. Cannot map to agreed.")
-                        # Optionally initialize agreed payments to zero or skip
-                        if not student.payments:
-                            student.payments = PaymentInfo()
-                        if not student.payments.agreed_payments:
-                            student.payments.agreed_payments = AgreedPayments() # Initialize empty/zeroed
-
-                    student.save()
+                    for attempt in range(1, MAX_UPDATE_ATTEMPTS + 1):
+                        before = mark_student_left(student)
+                        try:
+                            versioned_save(student, left_changes(before, student))
+                            break
+                        except SaveConditionError:
+                            # Another write landed since the student was read: map it again from the new state
+                            student = Student.objects.get(id=student.id)
+                            if student.isLeft or attempt == MAX_UPDATE_ATTEMPTS:
+                                raise
+                    before_documents.append(before)
+                    after_documents.append(snapshot(student))
                     updated_count += 1
                     updated_students_list.append(student.to_json()) # Append updated student data
+                except SaveConditionError:
+                    errors.append(f"Failed to update student {student.id}: modified by another user, reload it and retry.")
                 except Exception as e:
                     errors.append(f"Failed to update student {student.id}: {str(e)}")
                     # Optionally rollback or log more details
@@ -500,6 +810,8 @@ def batch_mark_left():
                  # If already left, still include in the response list if needed
                  updated_students_list.append(student.to_json())
 
+        if after_documents:
+            students_changed.send(None, before=before_documents, after=after_documents)
 
         if errors:
              return jsonify({
@@ -547,7 +859,10 @@ def batch_delete_students():
 
     try:
         # Perform the deletion
+        deleted_documents = list(Student.objects(id__in=student_ids).as_pymongo())
         deleted_count = Student.objects(id__in=student_ids).delete()
+        if deleted_documents:
+            students_changed.send(None, before=deleted_documents, after=[])
 
         if deleted_count == 0 and len(student_ids) > 0:
             return jsonify({'status': 'warning', 'message': 'No matching students found to delete.'}), 404
@@ -576,6 +891,12 @@ def batch_affect_class():
     if not classe_id:
         return jsonify({'status': 'error', 'message': 'Invalid input. "classe_id" is required.'}), 400
 
+    try:
+        # 'fields' restricts the returned student fields, e.g. fields=name,classe
+        fields = parse_fields(request.args.get('fields'), STUDENT_FIELDS)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
     try:
         # Validate the target class
         target_classe = Classe.objects.get(id=classe_id)
@@ -587,8 +908,16 @@ def batch_affect_class():
             return jsonify({'status': 'warning', 'message': 'No matching students found to update.'}), 404
 
         # Fetch the updated students to return their new state
-        updated_students = Student.objects(id__in=student_ids)
-        updated_students_data = [s.to_json() for s in updated_students]
+        if fields is not None:
+            updated_students = list(Student.objects(id__in=student_ids).only(*student_projection(fields, 'school_year')).as_pymongo())
+            classes = classe_names() if 'classe' in fields else {}
+            updated_students_data = [serialize_student(raw, classes, fields) for raw in updated_students]
+            # The projected documents cannot patch cached rows, so listeners reset them
+            students_changed.send(None, before=None, after=None)
+        else:
+            updated_students = list(Student.objects(id__in=student_ids))
+            updated_students_data = [s.to_json() for s in updated_students]
+            students_changed.send(None, before=None, after=[snapshot(s) for s in updated_students])
 
         return jsonify({
             'status': 'success',
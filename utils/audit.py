@@ -0,0 +1,140 @@
+# utils/audit.py
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from flask import current_app, has_app_context
+
+from models import Save, ChangeDetail
+
+
+class AuditWriter:
+    """
+    Writes Save records from a background thread so that auditing costs a
+    request one queue put. Records are inserted with insert_many every
+    batch_size records or flush_interval seconds, whichever comes first.
+    The queue is bounded: when the database falls behind, new records are
+    dropped (and counted) instead of growing memory or blocking requests.
+    """
+
+    def __init__(self, max_queue=10000, batch_size=100, flush_interval=0.5):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def record(self, document):
+        """Queues a raw Save document; never blocks."""
+        self._start()
+        try:
+            self.queue.put_nowait(document)
+        except queue.Full:
+            self.dropped += 1
+            logging.error(f"Audit queue full, dropped a Save record ({self.dropped} dropped so far)")
+
+    def _start(self):
+        # Started on first use, i.e. after gunicorn forked its workers
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._write(self._next_batch())
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            Save._get_collection().insert_many(batch, ordered=False)
+        except Exception as e:
+            logging.error(f"Failed to write {len(batch)} Save records: {e}")
+
+    def close(self, timeout=5):
+        """Stops the worker and writes every queued record; registered with atexit."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) == self.batch_size:
+                self._write(batch)
+                batch = []
+        self._write(batch)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_audit_writer():
+    """Returns the audit writer of this process, created from the app config on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                config = current_app.config if has_app_context() else {}
+                _writer = AuditWriter(
+                    max_queue=config.get('AUDIT_QUEUE_SIZE', 10000),
+                    batch_size=config.get('AUDIT_BATCH_SIZE', 100),
+                    flush_interval=config.get('AUDIT_FLUSH_MS', 500) / 1000.0
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+
+def _object_id(value):
+    value = str(getattr(value, 'id', value) or '')
+    return ObjectId(value) if ObjectId.is_valid(value) else None
+
+
+def record_save(student, user, types, changes, date=None):
+    """
+    Queues a Save record of changes (ChangeDetail or dicts with field_name,
+    old_value, new_value) made to a student. student and user may be
+    documents or ids.
+    """
+    if not changes:
+        return
+    if has_app_context() and not current_app.config.get('AUDIT_ENABLED', True):
+        return
+    get_audit_writer().record({
+        'student': _object_id(student),
+        'user': _object_id(user),
+        'date': date or datetime.utcnow(),
+        'types': list(types),
+        'changes': [
+            change.to_mongo().to_dict() if isinstance(change, ChangeDetail) else dict(change)
+            for change in changes
+        ]
+    })
@@ -0,0 +1,219 @@
+# utils/cache.py
+
+import hashlib
+import importlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from bson import ObjectId
+from flask import current_app, has_app_context, make_response, request
+
+from utils.signals import students_changed, depences_changed, classes_changed, daily_accounting_changed
+from models import SchoolYearPeriod
+from utils.versioning import data_versions, shared_data_versions
+
+# Generation counters of the cached reports. A report keyed by a school year
+# depends on that year and on GLOBAL_SCOPE (depences, classes); reports without
+# a school year depend on ALL_SCOPE, which every write bumps. Keys also carry
+# the persisted data versions (utils/versioning.py), bumped by every worker.
+GLOBAL_SCOPE = 'global'
+ALL_SCOPE = 'all'
+
+
+class CacheBackend:
+    """
+    Store used by the report cache. A shared store (e.g. Redis or memcached)
+    implements these methods so that every gunicorn worker reuses the same
+    entries, and is selected with REPORT_CACHE_BACKEND = 'module:Class'.
+    """
+
+    @classmethod
+    def from_config(cls, config):
+        return cls()
+
+    def get(self, key):
+        """Returns the stored bytes, or None when missing or expired."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        """Stores bytes for ttl seconds."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        """Atomically increments a counter (never evicted) and returns its new value."""
+        raise NotImplementedError
+
+    def counter(self, key):
+        """Returns the current value of a counter, 0 when it was never incremented."""
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """Per-process LRU store with a TTL per entry."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(max_entries=config.get('REPORT_CACHE_MAX_ENTRIES', 256))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _load_backend(config):
+    module_name, _, class_name = config.get('REPORT_CACHE_BACKEND', 'utils.cache:MemoryCache').partition(':')
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class.from_config(config)
+
+
+def get_cache():
+    """Returns the report cache backend of this process, created from the app config on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _load_backend(current_app.config)
+    return _backend
+
+
+def _bump(*scopes):
+    backend = _backend
+    if backend is None and has_app_context():
+        backend = get_cache()
+    if backend is None:
+        return
+    try:
+        for scope in scopes:
+            backend.incr(f'generation:{scope}')
+    except Exception as e:
+        # Entries still expire after REPORT_CACHE_TTL
+        logging.error(f"Failed to invalidate cached reports: {e}")
+
+
+def invalidate_reports(school_year_id=None):
+    """Drops the cached reports of a school year, or of every school year when None."""
+    _bump(str(school_year_id) if school_year_id else GLOBAL_SCOPE, ALL_SCOPE)
+
+
+def _cache_key(backend, school_year_id):
+    if school_year_id:
+        scopes = (str(school_year_id), GLOBAL_SCOPE)
+    else:
+        scopes = (ALL_SCOPE,)
+    generations = ':'.join(str(backend.counter(f'generation:{scope}')) for scope in scopes)
+    # The generations only move with the writes of this process (or of the
+    # processes sharing the backend); the data versions, which also feed the
+    # ETags, move with every write, including maintenance.py's
+    if school_year_id and ObjectId.is_valid(str(school_year_id)):
+        generations += ':v' + ':'.join(str(version) for version in data_versions(school_year_id))
+    elif not school_year_id:
+        generations += ':v' + ':'.join(str(version) for version in shared_data_versions())
+    query = sorted(request.args.items(multi=True))
+    digest = hashlib.sha1(repr(query).encode('utf-8')).hexdigest()
+    return f'report:{request.endpoint}:{":".join(scopes)}:{generations}:{digest}'
+
+
+def school_year_id_of(name):
+    """Returns the id of the school year with this name, None when there is none."""
+    school_year = SchoolYearPeriod.objects(name=name).only('id').as_pymongo().first()
+    return school_year['_id'] if school_year else None
+
+
+def cached_report(school_year_arg=None, school_year_name_arg=None):
+    """
+    Caches the successful responses of a report view, keyed by endpoint and
+    normalized query parameters. When school_year_arg (an id) or
+    school_year_name_arg (a name) is given, only writes to that school year
+    (or to shared data) invalidate the entry.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get('REPORT_CACHE_ENABLED', True):
+                return view(*args, **kwargs)
+
+            backend = get_cache()
+            school_year_id = request.args.get(school_year_arg) if school_year_arg else None
+            if school_year_name_arg and request.args.get(school_year_name_arg):
+                school_year_id = school_year_id_of(request.args[school_year_name_arg])
+            # The generations are read before the view runs so that a write
+            # landing meanwhile leaves the stored entry unreachable
+            key = _cache_key(backend, school_year_id)
+
+            cached = backend.get(key)
+            if cached is not None:
+                mimetype, _, body = cached.partition(b'\n')
+                return current_app.response_class(body, status=200, mimetype=mimetype.decode('ascii'))
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                value = response.mimetype.encode('ascii') + b'\n' + response.get_data()
+                backend.set(key, value, current_app.config.get('REPORT_CACHE_TTL', 60))
+            return response
+        return wrapper
+    return decorator
+
+
+@students_changed.connect
+def _on_students_changed(sender, before=None, after=None, **kwargs):
+    if after is None:
+        invalidate_reports()
+        return
+    for school_year_id in {str(document.get('school_year')) for document in (before or []) + after}:
+        invalidate_reports(school_year_id)
+
+
+@depences_changed.connect
+@classes_changed.connect
+def _on_shared_data_changed(sender, **kwargs):
+    invalidate_reports()
+
+
+@daily_accounting_changed.connect
+def _on_daily_accounting_changed(sender, **kwargs):
+    # Only the reports without a school year read validated days
+    _bump(ALL_SCOPE)
@@ -0,0 +1,75 @@
+# utils/concurrency.py
+#
+# Optimistic concurrency on Student documents. Every write bumps
+# Student.version and records, in Student.field_versions, the version at which
+# each field last changed (keyed by its leaf name, e.g. 'm9_agreed'). A client
+# sends back the version it loaded: its edit is merged when none of the fields
+# it changes were modified since, and rejected with 409 otherwise.
+
+from models import Student
+
+# Attempts of a read-modify-write before reporting a conflict
+MAX_UPDATE_ATTEMPTS = 3
+
+
+class VersionConflict(Exception):
+    """The fields an edit changes were modified since the version the client loaded."""
+
+    def __init__(self, fields):
+        super().__init__(f"Modified by another user since it was loaded: {', '.join(sorted(fields))}")
+        self.fields = sorted(fields)
+
+
+def field_key(field_name):
+    """Returns the field_versions key of a ChangeDetail field name ('agreed_payments.m9_agreed' -> 'm9_agreed')."""
+    return field_name.rsplit('.', 1)[-1]
+
+
+def parse_version(value):
+    """Returns the client's expected version as an int, None when not given. Raises ValueError."""
+    if value is None or value == '':
+        return None
+    version = int(value)
+    if version < 0:
+        raise ValueError("'version' must not be negative.")
+    return version
+
+
+def check_conflicts(field_versions, expected_version, changes):
+    """Raises VersionConflict when a changed field was modified after expected_version (None skips the check)."""
+    if expected_version is None:
+        return
+    changed = {field_key(change.field_name) for change in changes}
+    modified = {field for field, version in (field_versions or {}).items() if version > expected_version}
+    if changed & modified:
+        raise VersionConflict(changed & modified)
+
+
+def versioned_save(student, changes):
+    """
+    Saves a loaded Student only if no write landed since it was read, bumping
+    its version and the versions of the changed fields. Raises mongoengine's
+    SaveConditionError otherwise.
+    """
+    loaded_version = student.version or 0
+    version = loaded_version + 1
+    field_versions = dict(student.field_versions or {})
+    field_versions.update({field_key(change.field_name): version for change in changes})
+
+    student.version = version
+    student.field_versions = field_versions
+    # Documents written before versioning have no version field; {version: null} matches them
+    condition = {'version': loaded_version} if loaded_version else {'version__in': [0, None]}
+    student.save(save_condition=condition)
+
+
+def conflict_response(student_id, fields=None):
+    """Body of a 409 answer: the conflicting fields and the current student, to retry from."""
+    student = Student.objects(id=student_id).first()
+    return {
+        'status': 'error',
+        'message': 'The student was modified by another user. Reload it and retry.',
+        'conflicts': fields or [],
+        'student': student.to_json() if student else None
+    }
+
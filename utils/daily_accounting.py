@@ -0,0 +1,258 @@
+# utils/daily_accounting.py
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from models import Payment, Depence, DailyAccounting
+
+
+def day_bounds(day):
+    """Returns the [start, end) datetimes of a date."""
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+# Day of a stored (UTC) date, as a $group key
+_DAY = {'year': {'$year': '$date'}, 'month': {'$month': '$date'}, 'day': {'$dayOfMonth': '$date'}}
+
+
+def _day_of_group(group):
+    return datetime(group['_id']['year'], group['_id']['month'], group['_id']['day'])
+
+
+def _empty_payment_totals():
+    return {'total': 0.0, 'by_type': defaultdict(float), 'by_user': defaultdict(float), 'ids': []}
+
+
+def _empty_expense_totals():
+    return {'total': 0.0, 'ids': []}
+
+
+def _payment_groups(start, end):
+    pipeline = [
+        {'$group': {
+            '_id': dict(_DAY, payment_type='$payment_type', user='$user'),
+            'total': {'$sum': '$amount'},
+            'ids': {'$push': '$_id'}
+        }}
+    ]
+    return Payment.objects(date__gte=start, date__lt=end).aggregate(pipeline)
+
+
+def _expense_groups(start, end):
+    pipeline = [{'$group': {'_id': _DAY, 'total': {'$sum': '$amount'}, 'ids': {'$push': '$_id'}}}]
+    return Depence.objects(date__gte=start, date__lt=end).aggregate(pipeline)
+
+
+def _add_payment_group(totals, group):
+    user = group['_id'].get('user')
+    totals['total'] += group['total']
+    totals['by_type'][group['_id'].get('payment_type')] += group['total']
+    totals['by_user'][str(user) if user else 'none'] += group['total']
+    totals['ids'].extend(group['ids'])
+
+
+def _add_expense_group(totals, group):
+    totals['total'] += group['total']
+    totals['ids'].extend(group['ids'])
+
+
+def payment_totals(start, end):
+    """
+    Sums the payments dated in [start, end) with one $group by day, payment
+    type and user, returning the total, the subtotals and the payment ids.
+    """
+    totals = _empty_payment_totals()
+    for group in _payment_groups(start, end):
+        _add_payment_group(totals, group)
+    return totals
+
+
+def payment_totals_by_day(start, end):
+    """Same as payment_totals, per day: {midnight datetime: totals}."""
+    days = defaultdict(_empty_payment_totals)
+    for group in _payment_groups(start, end):
+        _add_payment_group(days[_day_of_group(group)], group)
+    return days
+
+
+def expense_totals(start, end):
+    """Sums the depences dated in [start, end) with one $group, returning the total and the ids."""
+    totals = _empty_expense_totals()
+    for group in _expense_groups(start, end):
+        _add_expense_group(totals, group)
+    return totals
+
+
+def expense_totals_by_day(start, end):
+    """Same as expense_totals, per day: {midnight datetime: totals}."""
+    days = defaultdict(_empty_expense_totals)
+    for group in _expense_groups(start, end):
+        _add_expense_group(days[_day_of_group(group)], group)
+    return days
+
+
+def _day_document(start, payments, expenses):
+    return {
+        'date': start,
+        'payments': payments['ids'],
+        'daily_expenses': expenses['ids'],
+        'total_payments': payments['total'],
+        'total_expenses': expenses['total'],
+        'net_profit': payments['total'] - expenses['total'],
+        'payments_by_type': dict(payments['by_type']),
+        'payments_by_user': dict(payments['by_user']),
+        'isValidated': True
+    }
+
+
+def close_day(day):
+    """
+    Validates the accounting of a day with one atomic upsert of its totals,
+    subtotals and references. Raises pymongo's DuplicateKeyError when the day
+    is already validated (the upsert then collides on the unique date).
+    """
+    start, end = day_bounds(day)
+    payments = payment_totals(start, end)
+    expenses = expense_totals(start, end)
+    previous = cumulative_totals_before(start)
+
+    document = _day_document(start, payments, expenses)
+    document['cumulative_payments'] = previous['payments'] + payments['total']
+    document['cumulative_expenses'] = previous['expenses'] + expenses['total']
+    collection = DailyAccounting._get_collection()
+    collection.update_one(
+        {'date': start, 'isValidated': {'$ne': True}},
+        {'$set': document},
+        upsert=True
+    )
+    # Days validated before this one (a backfill) now include its totals
+    collection.update_many(
+        {'date': {'$gt': start}, 'isValidated': True},
+        {'$inc': {'cumulative_payments': payments['total'], 'cumulative_expenses': expenses['total']}}
+    )
+    return document
+
+
+def cumulative_totals_before(date, inclusive=False):
+    """Returns the running totals of the validated days before a datetime (or on it, when inclusive)."""
+    last_day = DailyAccounting._get_collection().find_one(
+        {'date': {'$lte' if inclusive else '$lt': date}, 'isValidated': True},
+        {'cumulative_payments': 1, 'cumulative_expenses': 1},
+        sort=[('date', DESCENDING)]
+    ) or {}
+    return {
+        'payments': last_day.get('cumulative_payments', 0.0),
+        'expenses': last_day.get('cumulative_expenses', 0.0)
+    }
+
+
+def range_totals(start, end):
+    """
+    Returns the totals of the validated days in [start, end] as the difference
+    of two running totals, i.e. with two indexed lookups.
+    """
+    before = cumulative_totals_before(start)
+    through = cumulative_totals_before(end, inclusive=True)
+    total_payments = through['payments'] - before['payments']
+    total_expenses = through['expenses'] - before['expenses']
+    return {
+        'total_payments': total_payments,
+        'total_expenses': total_expenses,
+        'net_profit': total_payments - total_expenses
+    }
+
+
+def rebuild_cumulative_totals(since=None):
+    """Recomputes the running totals of the validated days (from a datetime on, when given), in date order."""
+    collection = DailyAccounting._get_collection()
+    query = {'isValidated': True}
+    cumulative_payments = cumulative_expenses = 0.0
+    if since is not None:
+        query['date'] = {'$gte': since}
+        previous = cumulative_totals_before(since)
+        cumulative_payments, cumulative_expenses = previous['payments'], previous['expenses']
+
+    operations = []
+    for day in collection.find(query, {'total_payments': 1, 'total_expenses': 1}).sort('date', 1):
+        cumulative_payments += day.get('total_payments', 0.0)
+        cumulative_expenses += day.get('total_expenses', 0.0)
+        operations.append(UpdateOne({'_id': day['_id']}, {'$set': {
+            'cumulative_payments': cumulative_payments,
+            'cumulative_expenses': cumulative_expenses
+        }}))
+
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def iter_close_days(first_day, last_day, chunk_days=31):
+    """
+    Validates every unvalidated day of [first_day, last_day], yielding the
+    progress {days, done_days, validated, skipped} after each chunk of days.
+    A chunk costs one $group by day over the payments, one over the depences
+    and a single bulk_write of upserts. The running totals are recomputed from
+    first_day on once the generator is exhausted or closed.
+    """
+    collection = DailyAccounting._get_collection()
+    total_days = (last_day - first_day).days + 1
+    validated = skipped = 0
+
+    try:
+        day = first_day
+        while day <= last_day:
+            chunk_last = min(day + timedelta(days=chunk_days - 1), last_day)
+            start, _ = day_bounds(day)
+            _, end = day_bounds(chunk_last)
+
+            closed = {row['date'] for row in collection.find(
+                {'date': {'$gte': start, '$lt': end}, 'isValidated': True}, {'date': 1}
+            )}
+            payments = payment_totals_by_day(start, end)
+            expenses = expense_totals_by_day(start, end)
+
+            operations = []
+            current = start
+            while current < end:
+                if current in closed:
+                    skipped += 1
+                else:
+                    document = _day_document(
+                        current,
+                        payments.get(current) or _empty_payment_totals(),
+                        expenses.get(current) or _empty_expense_totals()
+                    )
+                    operations.append(UpdateOne(
+                        {'date': current, 'isValidated': {'$ne': True}}, {'$set': document}, upsert=True
+                    ))
+                current += timedelta(days=1)
+
+            if operations:
+                try:
+                    collection.bulk_write(operations, ordered=False)
+                    validated += len(operations)
+                except BulkWriteError as e:
+                    # Days validated meanwhile collide on the unique date
+                    errors = e.details.get('writeErrors', [])
+                    if any(error.get('code') != 11000 for error in errors):
+                        raise
+                    validated += len(operations) - len(errors)
+                    skipped += len(errors)
+
+            day = chunk_last + timedelta(days=1)
+            yield {'days': total_days, 'done_days': (day - first_day).days, 'validated': validated, 'skipped': skipped}
+    finally:
+        # Also when the client stops reading: the days already written need their running totals
+        rebuild_cumulative_totals(since=datetime.combine(first_day, time.min))
+
+
+def close_days(first_day, last_day, chunk_days=31):
+    """Validates every unvalidated day of [first_day, last_day] and returns the final progress."""
+    result = None
+    for result in iter_close_days(first_day, last_day, chunk_days):
+        pass
+    return result
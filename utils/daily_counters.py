@@ -0,0 +1,91 @@
+# utils/daily_counters.py
+
+import logging
+from collections import defaultdict
+from datetime import datetime, time
+
+from pymongo import UpdateOne
+
+from models import DailyCounter
+from utils.daily_accounting import day_bounds, payment_totals, expense_totals
+from utils.signals import payments_changed, depences_changed, document_changes
+
+
+def day_of(date):
+    """Returns the DailyCounter key (midnight) of a datetime."""
+    return datetime.combine(date.date(), time.min)
+
+
+def _payment_increments(payment, sign):
+    user = payment.get('user')
+    amount = sign * payment.get('amount', 0.0)
+    return {
+        'total_payments': amount,
+        'payments_count': sign,
+        f"payments_by_type.{payment.get('payment_type')}": amount,
+        f"payments_by_user.{str(user) if user else 'none'}": amount
+    }
+
+
+def _expense_increments(expense, sign):
+    return {
+        'total_expenses': sign * expense.get('amount', 0.0),
+        'expenses_count': sign
+    }
+
+
+def apply_counter_changes(changes, increments):
+    """
+    Moves the amounts of changed documents, given as (before, after) pairs,
+    between day counters: subtracts each document as it was and adds it as it
+    is, with one bulk_write of a $inc upsert per day.
+    """
+    by_day = defaultdict(lambda: defaultdict(int))
+    for before, after in changes:
+        for document, sign in ((before, -1), (after, 1)):
+            if document is None:
+                continue
+            for field, value in increments(document, sign).items():
+                by_day[day_of(document['date'])][field] += value
+
+    operations = []
+    for day, fields in by_day.items():
+        deltas = {field: value for field, value in fields.items() if value}
+        if deltas:
+            operations.append(UpdateOne({'date': day}, {'$inc': deltas}, upsert=True))
+    if operations:
+        DailyCounter._get_collection().bulk_write(operations, ordered=False)
+
+
+def rebuild_daily_counter(day):
+    """Recomputes the counter of a date from its payments and depences."""
+    start, end = day_bounds(day)
+    payments = payment_totals(start, end)
+    expenses = expense_totals(start, end)
+    counter = {
+        'total_payments': payments['total'],
+        'total_expenses': expenses['total'],
+        'payments_count': len(payments['ids']),
+        'expenses_count': len(expenses['ids']),
+        'payments_by_type': dict(payments['by_type']),
+        'payments_by_user': dict(payments['by_user'])
+    }
+    DailyCounter._get_collection().update_one({'date': start}, {'$set': counter}, upsert=True)
+    return counter
+
+
+@payments_changed.connect
+def _on_payments_changed(sender, before=None, after=None, changes=None, **kwargs):
+    try:
+        apply_counter_changes(document_changes(before, after, changes), _payment_increments)
+    except Exception as e:
+        # The write itself succeeded; rebuild-daily-counters repairs the day
+        logging.error(f"Failed to update the daily counters: {e}")
+
+
+@depences_changed.connect
+def _on_depences_changed(sender, before=None, after=None, **kwargs):
+    try:
+        apply_counter_changes(document_changes(before, after), _expense_increments)
+    except Exception as e:
+        logging.error(f"Failed to update the daily counters: {e}")
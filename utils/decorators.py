@@ -0,0 +1,112 @@
+# utils/decorators.py
+
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+
+from bson import ObjectId
+from flask import current_app, jsonify, request, make_response
+from pymongo.errors import DuplicateKeyError
+
+from models import IdempotencyKey
+from utils.versioning import data_etag
+
+
+def etag_by_data_version(school_year_arg):
+    """
+    Answers a GET view with a strong ETag derived from the data version of the
+    school year given in the school_year_arg query parameter, and returns
+    304 Not Modified without running the view when If-None-Match matches.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            school_year_id = request.args.get(school_year_arg)
+            if not school_year_id or not ObjectId.is_valid(school_year_id):
+                return view(*args, **kwargs)
+
+            etag = data_etag(school_year_id, request.full_path)
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def idempotent(view):
+    """
+    Makes a POST view safe to retry. The first request carrying an
+    Idempotency-Key header claims the key (unique index) and stores its
+    response; retries with the same key and body get that response back
+    without running the view. Keys expire after IDEMPOTENCY_KEY_TTL seconds.
+    A running request holds its key for IDEMPOTENCY_LEASE seconds; when it
+    died without a response, a retry takes the key over once that lease is
+    past. Requests without the header run as before.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"status": "error", "message": "Idempotency-Key must be at most 255 characters."}), 400
+
+        collection = IdempotencyKey._get_collection()
+        claim = {'key': key, 'endpoint': request.endpoint}
+        request_hash = hashlib.sha1(request.get_data()).hexdigest()
+        ttl = current_app.config.get('IDEMPOTENCY_KEY_TTL', 86400)
+        lease = current_app.config.get('IDEMPOTENCY_LEASE', 60)
+        now = datetime.utcnow()
+        owner = uuid.uuid4().hex
+        holder = {
+            'request_hash': request_hash,
+            'owner': owner,
+            'locked_until': now + timedelta(seconds=lease),
+            'expires_at': now + timedelta(seconds=ttl)
+        }
+        try:
+            collection.insert_one(dict(claim, **holder))
+            claimed = True
+        except DuplicateKeyError:
+            # A claim without a response whose lease is past belongs to a worker that died
+            claimed = collection.find_one_and_update(
+                dict(claim, status_code=None, locked_until={'$not': {'$gt': now}}), {'$set': holder}
+            ) is not None
+        if not claimed:
+            stored = collection.find_one(claim)
+            if stored is None or stored.get('status_code') is None:
+                return jsonify({"status": "error", "message": "A request with this Idempotency-Key is still being processed."}), 409
+            if stored.get('request_hash') != request_hash:
+                return jsonify({"status": "error", "message": "This Idempotency-Key was already used for a different request."}), 422
+            response = current_app.response_class(
+                stored.get('body', ''), status=stored['status_code'], mimetype=stored.get('mimetype')
+            )
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        # Only the current holder may release or complete the claim
+        claim['owner'] = owner
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            collection.delete_one(claim)
+            raise
+
+        if response.status_code >= 500 or response.is_streamed:
+            # Nothing worth replaying: release the key so that a retry runs again
+            collection.delete_one(claim)
+        else:
+            collection.update_one(claim, {'$set': {
+                'status_code': response.status_code,
+                'body': response.get_data(as_text=True),
+                'mimetype': response.mimetype
+            }})
+        return response
+    return wrapper
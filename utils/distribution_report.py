@@ -0,0 +1,139 @@
+# utils/distribution_report.py
+
+from models import Student
+
+MONTHS = [
+    (9, 'September'),
+    (10, 'October'),
+    (11, 'November'),
+    (12, 'December'),
+    (1, 'January'),
+    (2, 'February'),
+    (3, 'March'),
+    (4, 'April'),
+    (5, 'May'),
+    (6, 'June')
+]
+
+# Report periods of each amount kind: (period name, AgreedPayments field)
+AMOUNT_KINDS = {
+    'tuition': [(month_name, f'm{month_num}_agreed') for month_num, month_name in MONTHS],
+    'transport': [(month_name, f'm{month_num}_transport_agreed') for month_num, month_name in MONTHS],
+    'insurance': [('Insurance', 'insurance_agreed')]
+}
+
+
+def _period_facets(amount, include_students, page, page_size, bucket_size):
+    """Builds the $facet sub-pipelines of one period; amount is the projected field name."""
+    match = {'$match': {amount: {'$gt': 0}}}
+    value = f'${amount}'
+
+    if bucket_size:
+        bucket = {'$multiply': [{'$floor': {'$divide': [value, bucket_size]}}, bucket_size]}
+    else:
+        bucket = value
+
+    facets = {
+        'stats': [
+            match,
+            {'$group': {
+                '_id': None,
+                'total': {'$sum': value},
+                'average': {'$avg': value},
+                'min': {'$min': value},
+                'max': {'$max': value},
+                'count': {'$sum': 1}
+            }}
+        ],
+        'distribution': [
+            match,
+            {'$group': {'_id': bucket, 'student_count': {'$sum': 1}}},
+            {'$sort': {'_id': 1}}
+        ]
+    }
+
+    if include_students:
+        students = [match]
+        if page_size:
+            students += [
+                {'$sort': {'name': 1, '_id': 1}},
+                {'$skip': (page - 1) * page_size},
+                {'$limit': page_size}
+            ]
+        students.append({'$project': {'name': 1, 'agreed_payment': value}})
+        facets['students'] = students
+
+    return facets
+
+
+def distribution_report(school_year_id, kind, include_students=True, page=1, page_size=None, bucket_size=None):
+    """
+    Computes, for every period of an amount kind ('tuition', 'transport' or
+    'insurance'), the statistics and distribution of the agreed amounts of the
+    students of a school year, in one $facet pipeline.
+
+    Amounts are truncated to integers and only students with an agreed amount
+    above 0 are counted. When include_students is set, each period also lists
+    its students, paginated by name when page_size is given.
+    """
+    periods = AMOUNT_KINDS[kind]
+
+    projection = {'name': 1}
+    facets = {}
+    for index, (_, field) in enumerate(periods):
+        amount = f'a{index}'
+        projection[amount] = {'$trunc': {'$ifNull': [f'$payments.agreed_payments.{field}', 0]}}
+        for facet_name, pipeline in _period_facets(amount, include_students, page, page_size, bucket_size).items():
+            facets[f'{amount}_{facet_name}'] = pipeline
+
+    pipeline = [{'$project': projection}, {'$facet': facets}]
+    result = next(iter(Student.objects(school_year=school_year_id).aggregate(pipeline)), {})
+
+    report = {}
+    for index, (period_name, _) in enumerate(periods):
+        amount = f'a{index}'
+        stats = (result.get(f'{amount}_stats') or [{}])[0]
+
+        period = {
+            'total_agreed': int(stats.get('total', 0)),
+            'student_count': stats.get('count', 0),
+            'payment_statistics': {
+                'average_agreed_payment': int(round(stats['average'])) if stats else 0,
+                'min_agreed_payment': int(stats.get('min', 0)),
+                'max_agreed_payment': int(stats.get('max', 0))
+            },
+            'payment_distribution': [
+                {'amount': int(row['_id']), 'student_count': row['student_count']}
+                for row in result.get(f'{amount}_distribution', [])
+            ]
+        }
+        if include_students:
+            period['students'] = [
+                {'id': str(row['_id']), 'name': row.get('name'), 'agreed_payment': int(row['agreed_payment'])}
+                for row in result.get(f'{amount}_students', [])
+            ]
+        report[period_name] = period
+
+    return report
+
+
+def report_options(args):
+    """
+    Reads the optional report parameters from the query string:
+    include_students (default true), page, page_size and bucket_size.
+    Raises ValueError on malformed values.
+    """
+    include_students = args.get('include_students', 'true').lower() not in ('0', 'false', 'no')
+    page = int(args.get('page', 1))
+    page_size = int(args['page_size']) if args.get('page_size') else None
+    bucket_size = int(args['bucket_size']) if args.get('bucket_size') else None
+
+    if page < 1 or (page_size is not None and page_size < 1) or (bucket_size is not None and bucket_size < 1):
+        raise ValueError("'page', 'page_size' and 'bucket_size' must be positive integers.")
+
+    return {
+        'include_students': include_students,
+        'page': page,
+        'page_size': page_size,
+        'bucket_size': bucket_size
+    }
@@ -0,0 +1,28 @@
+# utils/helpers.py
+
+
+def snapshot(document):
+    """Returns a detached copy of a document as stored in MongoDB (references as ObjectIds)."""
+    return document.to_mongo().to_dict()
+
+
+def reference_id(document, field_name):
+    """Returns the id stored in a ReferenceField without dereferencing it."""
+    value = document._data.get(field_name)
+    return getattr(value, 'id', value)
+
+
+def parse_fields(value, allowed):
+    """
+    Parses a comma-separated 'fields' query parameter.
+
+    Returns None when the parameter is absent (every field), otherwise the set
+    of requested fields. Raises ValueError on unknown field names.
+    """
+    if not value:
+        return None
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = fields - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}. Allowed: {', '.join(allowed)}.")
+    return fields
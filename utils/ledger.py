@@ -0,0 +1,143 @@
+# utils/ledger.py
+
+from bson import ObjectId
+from flask import current_app, has_app_context
+
+from models import Payment, Student
+from utils.cache import MemoryCache
+from utils.payment_matrix import SCHOOL_YEAR_MONTHS, REAL_FIELDS
+from utils.signals import students_changed
+from utils.versioning import data_versions
+
+REAL_PAYMENT_TYPES = ('monthly', 'transport', 'insurance')
+
+# Seconds a per-student ledger snapshot is kept; snapshots are keyed on the data
+# versions of the school year, so a write handled by any worker makes them unreachable
+SNAPSHOT_TTL = 300
+
+_snapshots = MemoryCache(max_entries=1024)
+
+
+def ledger_mode():
+    """True when REAL_PAYMENTS_SOURCE = 'ledger': the Payment collection is the source of the real amounts."""
+    return has_app_context() and current_app.config.get('REAL_PAYMENTS_SOURCE') == 'ledger'
+
+
+def real_field(payment_type, month):
+    """Returns the RealPayments field of a (payment type, month), or None when it has none."""
+    if payment_type == 'insurance':
+        return 'insurance_real'
+    if month not in SCHOOL_YEAR_MONTHS:
+        return None
+    if payment_type == 'monthly':
+        return f'm{month}_real'
+    if payment_type == 'transport':
+        return f'm{month}_transport_real'
+    return None
+
+
+def ledger_real_payments(student_ids):
+    """
+    Computes the real amounts of students from their payments with one $group:
+    the amount of the latest payment of each (type, month), as written by
+    /payments/create_or_update. Returns {student id: {real field: amount}}
+    with every field of RealPayments, 0 when the student has no payment for it.
+    """
+    pipeline = [
+        {'$sort': {'date': 1, '_id': 1}},
+        {'$group': {
+            '_id': {
+                'student': '$student',
+                'payment_type': '$payment_type',
+                # Insurance is paid once a year, whatever month the payment carries
+                'month': {'$cond': [{'$eq': ['$payment_type', 'insurance']}, None, '$month']}
+            },
+            'amount': {'$last': '$amount'}
+        }}
+    ]
+    real_payments = {student_id: dict.fromkeys(REAL_FIELDS, 0.0) for student_id in student_ids}
+    groups = Payment.objects(student__in=list(student_ids), payment_type__in=REAL_PAYMENT_TYPES).aggregate(pipeline)
+    for group in groups:
+        field = real_field(group['_id']['payment_type'], group['_id'].get('month'))
+        if field and group['_id']['student'] in real_payments:
+            real_payments[group['_id']['student']][field] = group['amount']
+    return real_payments
+
+
+def real_payments_of(student_id, school_year_id):
+    """
+    Returns the ledger real amounts of one student of a school year, from the
+    snapshot cache when present.
+    """
+    student_id = ObjectId(str(student_id))
+    key = f"{student_id}:{':'.join(str(version) for version in data_versions(school_year_id))}"
+    real_payments = _snapshots.get(key)
+    if real_payments is None:
+        real_payments = ledger_real_payments([student_id])[student_id]
+        _snapshots.set(key, real_payments, SNAPSHOT_TTL)
+    return dict(real_payments)
+
+
+def project_real_payments(student_ids, attempts=3):
+    """
+    Rewrites the embedded RealPayments of students from the ledger with one
+    read and one $group, then one write per student whose copy drifted. Each
+    write is conditioned on the student version read: only the students it
+    matched are signalled, and those edited meanwhile are projected again.
+    Returns the ids of the drifted students.
+    """
+    student_ids = [ObjectId(str(student_id)) for student_id in student_ids]
+    if not student_ids:
+        return []
+    ledger = ledger_real_payments(student_ids)
+
+    collection = Student._get_collection()
+    before, after, missed = [], [], []
+    for document in Student.objects(id__in=student_ids).as_pymongo():
+        payments = document.get('payments')
+        current = (payments or {}).get('real_payments') or {}
+        real_payments = ledger[document['_id']]
+        if all((current.get(field) or 0) == amount for field, amount in real_payments.items()):
+            continue
+
+        version = (document.get('version') or 0) + 1
+        field_versions = dict(document.get('field_versions') or {})
+        field_versions.update({
+            field: version for field, amount in real_payments.items() if (current.get(field) or 0) != amount
+        })
+        if payments is None:
+            update = {'payments': {'real_payments': real_payments}}
+        else:
+            update = {'payments.real_payments': dict(current, **real_payments)}
+        update.update(version=version, field_versions=field_versions)
+        # {version: null} also matches the students written before versioning
+        result = collection.update_one({'_id': document['_id'], 'version': document.get('version')}, {'$set': update})
+        if not result.matched_count:
+            missed.append(document['_id'])
+            continue
+        before.append(document)
+        after.append(dict(
+            document, version=version, field_versions=field_versions,
+            payments=dict(payments or {}, real_payments=dict(current, **real_payments))
+        ))
+
+    if after:
+        students_changed.send(None, before=before, after=after)
+    drifted = [document['_id'] for document in after]
+    if missed and attempts > 1:
+        drifted.extend(project_real_payments(missed, attempts - 1))
+    return drifted
+
+
+def rebuild_real_payments(school_year_id=None, batch_size=500):
+    """Projects the ledger onto every student (of a school year, when given) in batches; returns the drifted ids."""
+    query = Student.objects(school_year=school_year_id) if school_year_id else Student.objects
+    drifted, batch = [], []
+    for document in query.only('id').as_pymongo():
+        batch.append(document['_id'])
+        if len(batch) == batch_size:
+            drifted.extend(project_real_payments(batch))
+            batch = []
+    drifted.extend(project_real_payments(batch))
+    return drifted
+
@@ -0,0 +1,106 @@
+# utils/live_feed.py
+
+import json
+import logging
+import queue
+import threading
+
+from bson import json_util
+
+
+def format_event(event, data):
+    """Formats one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, default=json_util.default)}\n\n"
+
+
+class Subscription:
+    """Queue of the formatted events of one open stream."""
+
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        # Set when the stream fell behind; it then closes and the client reconnects
+        self.dropped = False
+
+
+class EventBroker:
+    """
+    Fans the events published in this process out to every open stream. A
+    publish costs one put per stream and no database access, so the load on
+    MongoDB does not depend on the number of open screens.
+    """
+
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    @property
+    def has_subscribers(self):
+        """True while at least one stream is open; publishers skip building events otherwise."""
+        return bool(self._subscriptions)
+
+    def subscribe(self):
+        subscription = Subscription(self.max_queue)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event, data):
+        message = format_event(event, data)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                subscription.dropped = True
+                self.unsubscribe(subscription)
+
+    def stream(self, subscription, snapshot, heartbeat):
+        """
+        Yields the snapshot event, then the published events, with a comment
+        line every heartbeat seconds to keep idle connections open.
+        """
+        try:
+            yield format_event('snapshot', snapshot)
+            while not subscription.dropped:
+                try:
+                    yield subscription.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+        finally:
+            self.unsubscribe(subscription)
+
+
+def watch_collections(collections, on_change):
+    """
+    Starts a daemon thread following a MongoDB change stream (replica sets only)
+    on the given pymongo collections, calling on_change(collection_name,
+    operation, document) for inserts, updates, replaces and deletes.
+    Deleted documents only carry their _id.
+    """
+    database = collections[0].database
+    names = [collection.name for collection in collections]
+    pipeline = [{'$match': {
+        'ns.coll': {'$in': names},
+        'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}
+    }}]
+
+    def run():
+        while True:
+            try:
+                with database.watch(pipeline, full_document='updateLookup') as changes:
+                    for change in changes:
+                        document = change.get('fullDocument') or change['documentKey']
+                        on_change(change['ns']['coll'], change['operationType'], document)
+            except Exception as e:
+                logging.error(f"Live feed change stream stopped, restarting: {e}")
+                threading.Event().wait(5)
+
+    thread = threading.Thread(target=run, name='live-feed-change-stream', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,166 @@
+# utils/payment_matrix.py
+
+import threading
+import time
+
+import numpy as np
+from flask import current_app
+
+from models import Student
+from utils.signals import students_changed
+from utils.versioning import data_versions
+
+# School year months in display order: September..December, then January..June
+SCHOOL_YEAR_MONTHS = [9, 10, 11, 12, 1, 2, 3, 4, 5, 6]
+
+# Column layout of the agreed/real arrays: 10 tuition months, 10 transport months, insurance
+AGREED_FIELDS = (
+    [f'm{month}_agreed' for month in SCHOOL_YEAR_MONTHS]
+    + [f'm{month}_transport_agreed' for month in SCHOOL_YEAR_MONTHS]
+    + ['insurance_agreed']
+)
+REAL_FIELDS = [field.replace('_agreed', '_real') for field in AGREED_FIELDS]
+
+TUITION_COLUMNS = slice(0, 10)
+TRANSPORT_COLUMNS = slice(10, 20)
+INSURANCE_COLUMN = 20
+
+# School year index (1..10) of each calendar month; months outside the school year never join
+_JOIN_INDEX = np.full(13, len(SCHOOL_YEAR_MONTHS) + 1, dtype=int)
+for _index, _month in enumerate(SCHOOL_YEAR_MONTHS, start=1):
+    _JOIN_INDEX[_month] = _index
+
+# Student.joined_month when the document has none
+DEFAULT_JOINED_MONTH = 9
+
+# Fields read from MongoDB to build a matrix
+PROJECTION = ('name', 'school_year', 'classe', 'joined_month', 'isLeft', 'payments')
+
+
+class PaymentMatrix:
+    """
+    Column-oriented, read-only view of the students of one school year.
+
+    Rows follow the order in which MongoDB returned the students. Numeric
+    columns are NumPy arrays; agreed and real hold one column per entry of
+    AGREED_FIELDS / REAL_FIELDS.
+    """
+
+    def __init__(self, ids, names, classe_ids, joined_month, is_left, agreed, real):
+        self.ids = ids
+        self.names = names
+        self.classe_ids = classe_ids
+        self.joined_month = joined_month
+        self.is_left = is_left
+        self.agreed = agreed
+        self.real = real
+        self.built_at = time.monotonic()
+        # (school year, global) data versions the matrix was loaded at
+        self.data_versions = None
+        self._rows = {student_id: row for row, student_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _row_values(document):
+        payments = document.get('payments') or {}
+        agreed = payments.get('agreed_payments') or {}
+        real = payments.get('real_payments') or {}
+        return (
+            [agreed.get(field) or 0 for field in AGREED_FIELDS],
+            [real.get(field) or 0 for field in REAL_FIELDS]
+        )
+
+    @classmethod
+    def from_documents(cls, documents):
+        ids, names, classe_ids, joined_month, is_left, agreed, real = [], [], [], [], [], [], []
+        for document in documents:
+            ids.append(str(document['_id']))
+            names.append(document.get('name'))
+            classe_ids.append(str(document['classe']) if document.get('classe') else None)
+            # A student stored without joined_month joined in September, as Student.joined_month defaults
+            joined_month.append(document.get('joined_month') or DEFAULT_JOINED_MONTH)
+            is_left.append(bool(document.get('isLeft')))
+            agreed_row, real_row = cls._row_values(document)
+            agreed.append(agreed_row)
+            real.append(real_row)
+
+        return cls(
+            ids, names, classe_ids,
+            np.array(joined_month, dtype=int),
+            np.array(is_left, dtype=bool),
+            np.array(agreed, dtype=float).reshape(-1, len(AGREED_FIELDS)),
+            np.array(real, dtype=float).reshape(-1, len(REAL_FIELDS))
+        )
+
+    def row_of(self, student_id):
+        return self._rows.get(str(student_id))
+
+    def joined_mask(self):
+        """Boolean array (students x 10 months), True from the month each student joined."""
+        join_index = _JOIN_INDEX[np.clip(self.joined_month, 0, 12)]
+        return join_index[:, np.newaxis] <= np.arange(1, len(SCHOOL_YEAR_MONTHS) + 1)
+
+
+# ----------------------------------------
+# Per-school-year cache
+# ----------------------------------------
+_matrices = {}
+_lock = threading.Lock()
+
+
+def load_payment_matrix(school_year_id):
+    """Builds the matrix of a school year with one projected query."""
+    documents = Student.objects(school_year=school_year_id).only(*PROJECTION).as_pymongo()
+    return PaymentMatrix.from_documents(documents)
+
+
+def get_payment_matrix(school_year_id):
+    """
+    Returns the cached matrix of the school year, building it on first use.
+
+    Each worker process keeps its own cache, keyed on the data versions of the
+    school year: a matrix is rebuilt as soon as a write (in any worker) bumped
+    them, or when it is older than PAYMENT_MATRIX_MAX_AGE seconds.
+    """
+    key = str(school_year_id)
+    max_age = current_app.config.get('PAYMENT_MATRIX_MAX_AGE', 300)
+    versions = data_versions(key)
+
+    def is_current(matrix):
+        return (
+            matrix is not None and matrix.data_versions == versions
+            and time.monotonic() - matrix.built_at < max_age
+        )
+
+    matrix = _matrices.get(key)
+    if is_current(matrix):
+        return matrix
+
+    with _lock:
+        matrix = _matrices.get(key)
+        if not is_current(matrix):
+            # Versions read before the load: a write landing meanwhile forces another rebuild
+            matrix = load_payment_matrix(key)
+            matrix.data_versions = versions
+            _matrices[key] = matrix
+        return matrix
+
+
+def invalidate_payment_matrix(school_year_id=None):
+    """Drops the matrix of one school year, or of every school year when None."""
+    with _lock:
+        if school_year_id is None:
+            _matrices.clear()
+        else:
+            _matrices.pop(str(school_year_id), None)
+
+
+@students_changed.connect
+def _on_students_changed(sender, before=None, after=None, **kwargs):
+    if after is None:
+        invalidate_payment_matrix()
+        return
+    for school_year_id in {str(document.get('school_year')) for document in (before or []) + after}:
+        invalidate_payment_matrix(school_year_id)
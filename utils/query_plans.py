@@ -0,0 +1,61 @@
+# utils/query_plans.py
+
+from datetime import datetime
+
+from bson import ObjectId
+
+from models import Payment, Depence, Save
+from utils.daily_accounting import day_bounds
+
+
+def hot_queries():
+    """
+    Returns (name, document class, filter) for the queries run on every
+    payment posting, daily view and history page, with placeholder values.
+    """
+    start, end = day_bounds(datetime.now().date())
+    today = {'$gte': start, '$lt': end}
+    return [
+        ('payment of a student today', Payment, {
+            'student': ObjectId(), 'payment_type': 'monthly', 'month': 9, 'date': today
+        }),
+        ('payments of students today', Payment, {'student': {'$in': [ObjectId()]}, 'date': today}),
+        ('payments of a day', Payment, {'date': today}),
+        ('depences of a day', Depence, {'date': today}),
+        ('history of a student', Save, {'student': ObjectId()}),
+        ('history of a user', Save, {'user': ObjectId()}),
+        ('history of a field', Save, {'changes.field_name': 'real_payments.m9_real'})
+    ]
+
+
+def plan_stages(plan):
+    """Yields the stage names of an explain() plan tree."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from plan_stages(value)
+
+
+def collection_scans():
+    """
+    Explains every hot query (after creating the declared indexes) and returns
+    the names of those whose winning plan scans the whole collection.
+    """
+    scans = []
+    for name, document_class, query in hot_queries():
+        document_class.ensure_indexes()
+        explanation = document_class._get_collection().find(query).explain()
+        if 'COLLSCAN' in plan_stages(explanation['queryPlanner']['winningPlan']):
+            scans.append(name)
+    return scans
+
+
+def check_query_plans():
+    """Raises RuntimeError when a hot query falls back to a collection scan."""
+    scans = collection_scans()
+    if scans:
+        raise RuntimeError(f"Queries without a usable index (COLLSCAN): {', '.join(scans)}")
@@ -0,0 +1,35 @@
+# utils/signals.py
+
+from blinker import Namespace
+
+# Signals fired by the write paths of the blueprints. Caches and derived data
+# subscribe to them instead of being called from every route.
+_signals = Namespace()
+
+# students_changed: sent with the raw Mongo documents of the affected students
+#   before=[...]  the documents before the write (a created student is absent)
+#   after=[...]   the documents after the write (a deleted student is absent)
+# before=None means the previous state is unknown but amounts did not change;
+# after=None means any student may have changed and listeners must reset.
+students_changed = _signals.signal('students-changed')
+
+# payments_changed: sent once per created, updated or deleted Payment with its
+# raw document before=... / after=... (None when created / deleted), or once
+# per batch of writes with changes=[(before, after), ...]
+payments_changed = _signals.signal('payments-changed')
+
+# depences_changed: sent once per created, updated or deleted Depence with its
+# raw document before=... / after=... (None when created / deleted)
+depences_changed = _signals.signal('depences-changed')
+
+# classes_changed: sent when classes are created, renamed, reordered or deleted
+classes_changed = _signals.signal('classes-changed')
+
+# daily_accounting_changed: sent when DailyAccounting days are validated, with
+# date=... the validated day (None when several days were validated)
+daily_accounting_changed = _signals.signal('daily-accounting-changed')
+
+
+def document_changes(before=None, after=None, changes=None):
+    """Returns the (before, after) pairs of a payments_changed or depences_changed send."""
+    return changes if changes is not None else [(before, after)]
@@ -0,0 +1,115 @@
+# utils/summaries.py
+
+import logging
+from collections import defaultdict
+
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from models import MonthlySummary
+from utils.payment_matrix import (
+    PaymentMatrix, load_payment_matrix, SCHOOL_YEAR_MONTHS,
+    TUITION_COLUMNS, TRANSPORT_COLUMNS, INSURANCE_COLUMN
+)
+from utils.signals import students_changed
+
+SUMMARY_FIELDS = ('agreed', 'real', 'outstanding', 'student_count', 'unpaid_count')
+
+
+def _totals(agreed, real):
+    return {
+        'agreed': float(agreed.sum()),
+        'real': float(real.sum()),
+        'outstanding': float(np.clip(agreed - real, 0, None).sum()),
+        'student_count': int((agreed > 0).sum()),
+        'unpaid_count': int((real < agreed).sum())
+    }
+
+
+def summarize(matrix):
+    """
+    Returns {(month, kind): totals} for the students of a payment matrix.
+
+    Tuition and transport only count the months a student had joined, like the
+    credit report; insurance is stored with month None.
+    """
+    joined = matrix.joined_mask()
+    summaries = {}
+    for kind, columns in (('tuition', TUITION_COLUMNS), ('transport', TRANSPORT_COLUMNS)):
+        agreed = matrix.agreed[:, columns] * joined
+        real = matrix.real[:, columns] * joined
+        for month_index, month in enumerate(SCHOOL_YEAR_MONTHS):
+            summaries[(month, kind)] = _totals(agreed[:, month_index], real[:, month_index])
+    summaries[(None, 'insurance')] = _totals(matrix.agreed[:, INSURANCE_COLUMN], matrix.real[:, INSURANCE_COLUMN])
+    return summaries
+
+
+def _summary_filter(school_year_id, month, kind):
+    return {'school_year': ObjectId(str(school_year_id)), 'month': month, 'kind': kind}
+
+
+def apply_summary_deltas(school_year_id, before_documents, after_documents):
+    """Applies the difference between two sets of student documents with atomic $inc updates."""
+    before = summarize(PaymentMatrix.from_documents(before_documents))
+    after = summarize(PaymentMatrix.from_documents(after_documents))
+
+    operations = []
+    for key, after_totals in after.items():
+        deltas = {
+            field: after_totals[field] - before[key][field]
+            for field in SUMMARY_FIELDS
+            if after_totals[field] != before[key][field]
+        }
+        if deltas:
+            # No upsert: a year whose summaries were never built gets them from rebuild_summaries
+            operations.append(UpdateOne(_summary_filter(school_year_id, *key), {'$inc': deltas}))
+
+    if operations:
+        MonthlySummary._get_collection().bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def rebuild_summaries(school_year_id):
+    """Recomputes every summary of a school year from its Student documents."""
+    summaries = summarize(load_payment_matrix(school_year_id))
+    operations = [
+        UpdateOne(_summary_filter(school_year_id, *key), {'$set': totals}, upsert=True)
+        for key, totals in summaries.items()
+    ]
+    MonthlySummary._get_collection().bulk_write(operations, ordered=False)
+    return summaries
+
+
+def summaries_built(school_year_id):
+    """True when every summary of a school year exists, i.e. rebuild_summaries ran for it."""
+    count = MonthlySummary.objects(school_year=ObjectId(str(school_year_id))).count()
+    return count >= len(SCHOOL_YEAR_MONTHS) * 2 + 1
+
+
+def ensure_summaries(school_year_id):
+    """Builds the summaries of a school year that has none yet; returns True when it did."""
+    if summaries_built(school_year_id):
+        return False
+    rebuild_summaries(school_year_id)
+    return True
+
+
+@students_changed.connect
+def _on_students_changed(sender, before=None, after=None, **kwargs):
+    # Unknown previous state means the write did not touch any amount
+    if before is None or after is None:
+        return
+
+    documents_by_year = defaultdict(lambda: ([], []))
+    for document in before:
+        documents_by_year[str(document.get('school_year'))][0].append(document)
+    for document in after:
+        documents_by_year[str(document.get('school_year'))][1].append(document)
+
+    for school_year_id, (before_documents, after_documents) in documents_by_year.items():
+        try:
+            apply_summary_deltas(school_year_id, before_documents, after_documents)
+        except Exception as e:
+            # The write itself succeeded; a rebuild repairs the summaries
+            logging.error(f"Failed to update monthly summaries of {school_year_id}: {e}")
@@ -0,0 +1,81 @@
+# utils/versioning.py
+
+import hashlib
+import logging
+
+from models import DataVersion
+from utils.signals import students_changed, depences_changed, classes_changed, daily_accounting_changed
+
+# Version key of the data shared by every school year (depences, classes)
+GLOBAL_SCOPE = 'global'
+# Version key of the validated days (DailyAccounting), read by the reports without a school year
+DAILY_ACCOUNTING_SCOPE = 'daily_accounting'
+
+
+def bump_data_version(school_year_id=None):
+    """Increments the data version of a school year (or of a scope key), or the global one when None."""
+    key = str(school_year_id) if school_year_id else GLOBAL_SCOPE
+    try:
+        DataVersion.objects(key=key).update_one(inc__version=1, upsert=True)
+    except Exception as e:
+        # The write itself succeeded; clients keep a stale copy until the next bump
+        logging.error(f"Failed to bump data version {key}: {e}")
+
+
+def _versions(keys):
+    versions = {
+        row['key']: row.get('version', 0)
+        for row in DataVersion.objects(key__in=keys).only('key', 'version').as_pymongo()
+    }
+    return tuple(versions.get(key, 0) for key in keys)
+
+
+def data_versions(school_year_id):
+    """
+    Returns the (school year, global) data versions with one indexed lookup.
+    Every per-process copy served under an ETag (payment matrices, cached
+    reports) is keyed on them, so that a write handled by another worker is
+    never served under the new ETag.
+    """
+    return _versions([str(school_year_id), GLOBAL_SCOPE])
+
+
+def shared_data_versions():
+    """Returns the (global, daily accounting) data versions, which key the data not tied to a school year."""
+    return _versions([GLOBAL_SCOPE, DAILY_ACCOUNTING_SCOPE])
+
+
+def data_etag(school_year_id, representation):
+    """
+    Returns a strong ETag for a representation (e.g. path and query string) of
+    the data of a school year. It changes whenever the school year or the
+    global data version is bumped.
+    """
+    year_version, global_version = data_versions(school_year_id)
+    token = f"{representation}|{year_version}|{global_version}"
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+
+@students_changed.connect
+def _on_students_changed(sender, before=None, after=None, **kwargs):
+    if after is None:
+        bump_data_version()
+        return
+    school_years = {str(document.get('school_year')) for document in (before or []) + after}
+    for school_year_id in school_years:
+        bump_data_version(school_year_id)
+
+
+@depences_changed.connect
+def _on_depences_changed(sender, **kwargs):
+    bump_data_version()
+
+
+@classes_changed.connect
+def _on_classes_changed(sender, **kwargs):
+    bump_data_version()
+
+
+@daily_accounting_changed.connect
+def _on_daily_accounting_changed(sender, **kwargs):
+    bump_data_version(DAILY_ACCOUNTING_SCOPE)